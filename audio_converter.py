@@ -2,11 +2,12 @@ import yaml
 import librosa
 import numpy as np
 import torch
-import soundfile as sf
+import instrumentation
+from audio_io import AudioReader
 from torch.utils.data import DataLoader
 
 class AudioConverter:
-    def __init__(self):
+    def __init__(self, audio_cache_size_mb=None):
         # print("Audio Converter Here!")
 
         self.hyper_parameters = self.load_hyper_parameters()
@@ -18,6 +19,9 @@ class AudioConverter:
         self.frame_size_samples = self.acoustic_features['frame_size_samples']
         self.hop_size_samples = self.acoustic_features['hop_size_samples']
         self.number_of_mels = self.acoustic_features['number_of_mels']
+        self.sample_rate = self.acoustic_features.get('sample_rate', 16000) #only used when a clip's own rate is unknown, e.g. for model output
+
+        self.audio_reader = AudioReader(cache_size_mb=audio_cache_size_mb) #decoded PCM is cached, so wav_to_mel and get_top_frequencies on one file decode it once
 
         self.training_parameters = self.hyper_parameters['training_parameters']
         self.batch_size = self.training_parameters['batch_size']
@@ -30,28 +34,50 @@ class AudioConverter:
 
 
     def wav_to_mel(self, wav_path):
-        amplitude, sample_rate = librosa.load(wav_path, sr=None, mono=True) #load audio file
+        with self.borrow_audio(wav_path) as (amplitude, sample_rate): #load audio file
+            mel_audio = self.amplitude_to_mel(amplitude, sample_rate)
+
+        return mel_audio.shape[1], mel_audio
+
+
+    #> Same result as librosa.load(wav_path, sr=None, mono=True), but float32 straight from soundfile and cached
+    def load_audio(self, wav_path):
+        return self.audio_reader.read(wav_path)
+
+
+    #> load_audio for a single use, the amplitude is only valid inside the with block
+    def borrow_audio(self, wav_path):
+        return self.audio_reader.borrow(wav_path)
 
+
+    #> Sample rate the clip was recorded at, as found when it was decoded
+    def sample_rate_of(self, wav_path):
+        return self.audio_reader.sample_rate(wav_path)
+
+
+    def amplitude_to_mel(self, amplitude, sample_rate):
         #> setup audio clip specific acoustic features
         frame_size_samples = int(self.frame_size_seconds * sample_rate)
         hop_size_samples = frame_size_samples // 2
         number_of_mels = self.number_of_mels
 
         #> conversion to mel spectrogram
-        mel_audio = librosa.feature.melspectrogram(
-            y           = amplitude,
-            sr          = sample_rate,
-            n_fft       = frame_size_samples,
-            hop_length  = hop_size_samples,
-            n_mels      = number_of_mels
-        )
-        mel_audio = librosa.power_to_db(mel_audio, ref=np.max) #convert to decibels
-
-        return mel_audio.shape[1], mel_audio
+        with instrumentation.span("audio.mel"):
+            mel_audio = librosa.feature.melspectrogram(
+                y           = amplitude,
+                sr          = sample_rate,
+                n_fft       = frame_size_samples,
+                hop_length  = hop_size_samples,
+                n_mels      = number_of_mels
+            )
+            mel_audio = librosa.power_to_db(mel_audio, ref=np.max) #convert to decibels
+
+        return mel_audio
     
     def wav_to_input_with_freq(self, wav_path, n=10):
-        clip_length, audio = self.wav_to_input(wav_path)
-        top_frequencies = self.get_top_frequencies(wav_path, n=n)
+        with self.borrow_audio(wav_path) as (amplitude, sample_rate): #decode once, used for both the mel input and the top frequencies
+            clip_length, audio = self.mel_to_input(self.amplitude_to_mel(amplitude, sample_rate))
+            top_frequencies = self.amplitude_to_top_frequencies(amplitude, sample_rate, n=n)
 
         new_columns = np.tile(np.array(top_frequencies).reshape(1, -1), (clip_length, 1))
 
@@ -60,7 +86,10 @@ class AudioConverter:
         return clip_length, result
 
     def get_top_frequencies(self, wav_path, n=10):
-        amplitude, sampling_rate = librosa.load(wav_path, sr=None, mono=True)
+        amplitude, sampling_rate = self.load_audio(wav_path)
+        return self.amplitude_to_top_frequencies(amplitude, sampling_rate, n=n)
+
+    def amplitude_to_top_frequencies(self, amplitude, sampling_rate, n=10):
         stft = librosa.stft(amplitude, n_fft=self.frame_size_samples, hop_length=self.hop_size_samples)
         
         magnitudes = np.abs(stft)
@@ -75,8 +104,9 @@ class AudioConverter:
 
 
     def mel_to_input(self, mel_audio):
-        trimmed_audio = self.trim(mel_audio, mel_audio.shape[1])
-        concatenated_audio = self.concatenate(trimmed_audio)
+        with instrumentation.span("audio.concatenate"):
+            trimmed_audio = self.trim(mel_audio, mel_audio.shape[1])
+            concatenated_audio = self.concatenate(trimmed_audio)
         return concatenated_audio.shape[0], concatenated_audio
         
 
@@ -100,12 +130,13 @@ class AudioConverter:
 
         return output_reshaped
 
-    def mel_to_wav(self, mel_audio):
+    def mel_to_wav(self, mel_audio, sample_rate=None):
+        sample_rate = sample_rate if sample_rate is not None else self.sample_rate #pass sample_rate_of(wav_path) to rebuild at the clip's own rate
         linear_audio = librosa.db_to_power(mel_audio, ref=1.0) #convert back to linear scale
         
         mel_to_linear = librosa.feature.inverse.mel_to_audio(
             linear_audio,
-            sr=16000,
+            sr=sample_rate,
             n_fft=self.frame_size_samples,
             hop_length=self.hop_size_samples
         )
@@ -118,6 +149,6 @@ class AudioConverter:
         return self.mel_to_input(mel_audio)
     
 
-    def output_to_wav(self, output):
-        lengths, mel_audio = self.output_to_mel(output)
-        return self.mel_to_wav(mel_audio)
\ No newline at end of file
+    def output_to_wav(self, output, sample_rate=None):
+        mel_audio = self.output_to_mel(output)
+        return self.mel_to_wav(mel_audio, sample_rate)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import yaml
+import threading
+import contextlib
+import numpy as np
+import soundfile as sf
+import instrumentation
+from collections import OrderedDict
+
+#> Decodes WAVs through soundfile straight into float32, at their own sample rate (no resampling).
+#> Decoded PCM is kept in a byte-bounded LRU cache, so extracting several features from a file decodes it once.
+#>   audio_reader = AudioReader()
+#>   amplitude, sample_rate = audio_reader.read(wav_path)
+#>   with audio_reader.borrow(wav_path) as (amplitude, sample_rate): ...   #pooled buffer, only valid inside the block
+
+class BufferPool:
+    def __init__(self, max_buffers=8):
+        self.max_buffers = max_buffers
+        self.buffers = {} #number of samples -> free float32 buffers of that length
+        self.lock = threading.Lock()
+
+
+    def acquire(self, number_of_samples):
+        with self.lock:
+            free_buffers = self.buffers.get(number_of_samples)
+            if free_buffers:
+                return free_buffers.pop()
+        return np.empty(number_of_samples, dtype=np.float32)
+
+
+    def release(self, buffer):
+        with self.lock:
+            if sum(len(free_buffers) for free_buffers in self.buffers.values()) < self.max_buffers:
+                self.buffers.setdefault(len(buffer), []).append(buffer)
+
+
+
+class AudioReader:
+    def __init__(self, cache_size_mb=None, max_buffers=None):
+        self.hyper_parameters = self.load_hyper_parameters()
+
+        self.audio_parameters = self.hyper_parameters.get('audio_parameters', {})
+        self.cache_size_mb = cache_size_mb if cache_size_mb is not None else self.audio_parameters.get('cache_size_mb', 512)
+        self.cache_size_bytes = int(self.cache_size_mb * 1024**2)
+        max_buffers = max_buffers if max_buffers is not None else self.audio_parameters.get('buffer_pool_size', 8)
+
+        self.cache = OrderedDict() #key -> (amplitude, sample_rate), least recently used first
+        self.current_size_bytes = 0
+        self.buffer_pool = BufferPool(max_buffers)
+        self.sample_rates = {} #absolute path -> sample rate the clip was recorded at
+        self.lock = threading.Lock()
+
+
+    def load_hyper_parameters(self):
+        with open("hyper_parameters.yaml", 'r') as file:
+            return yaml.safe_load(file)
+
+
+    #> Cache key of a file on disk, None for file-like objects (e.g. a zip member in memory) which are never cached
+    def key(self, wav_path):
+        if not isinstance(wav_path, (str, os.PathLike)):
+            return None
+        stat = os.stat(wav_path)
+        return os.path.abspath(wav_path), stat.st_mtime_ns, stat.st_size
+
+
+    #> Returns (amplitude, sample_rate) like librosa.load(wav_path, sr=None, mono=True), the array is owned by the caller or the cache
+    def read(self, wav_path):
+        key = self.key(wav_path)
+
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        amplitude, sample_rate = self.decode(wav_path)
+        self.put(key, amplitude, sample_rate)
+        return amplitude, sample_rate
+
+
+    #> Like read, but a file that is not cached yet is decoded into a pooled buffer which is reused once the block ends
+    @contextlib.contextmanager
+    def borrow(self, wav_path):
+        key = self.key(wav_path)
+
+        cached = self.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        if key is not None and self.cache_size_bytes > 0:
+            yield self.read(wav_path) #worth keeping, the cache owns the array
+            return
+
+        amplitude, sample_rate = self.decode(wav_path, self.buffer_pool)
+        try:
+            yield amplitude, sample_rate
+        finally:
+            self.buffer_pool.release(amplitude)
+
+
+    def decode(self, wav_path, buffer_pool=None):
+        with instrumentation.span("audio.decode"), sf.SoundFile(wav_path) as sound_file:
+            sample_rate = sound_file.samplerate
+
+            if sound_file.channels == 1: #DCASE clips, read straight into the buffer
+                amplitude = buffer_pool.acquire(sound_file.frames) if buffer_pool is not None else np.empty(sound_file.frames, dtype=np.float32)
+                samples_read = len(sound_file.read(out=amplitude)) #the dtype of the buffer decides the conversion, int16 PCM ends up in [-1, 1)
+                amplitude = amplitude[:samples_read]
+            else: #downmix like librosa does
+                amplitude = np.ascontiguousarray(sound_file.read(dtype='float32', always_2d=True).mean(axis=1))
+
+        if isinstance(wav_path, (str, os.PathLike)):
+            self.sample_rates[os.path.abspath(wav_path)] = sample_rate
+
+        return amplitude, sample_rate
+
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+        instrumentation.count("audio.cache_hits" if cached is not None else "audio.cache_misses")
+        return cached
+
+
+    def put(self, key, amplitude, sample_rate):
+        if key is None or amplitude.nbytes > self.cache_size_bytes:
+            return
+
+        amplitude.flags.writeable = False #shared between every caller that reads this file
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key] = (amplitude, sample_rate)
+            self.current_size_bytes += amplitude.nbytes
+
+            while self.current_size_bytes > self.cache_size_bytes:
+                _, (evicted, _) = self.cache.popitem(last=False)
+                self.current_size_bytes -= evicted.nbytes
+
+
+    def sample_rate(self, wav_path):
+        path = os.path.abspath(wav_path)
+        if path not in self.sample_rates:
+            self.sample_rates[path] = sf.info(wav_path).samplerate
+        return self.sample_rates[path]
+
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.current_size_bytes = 0
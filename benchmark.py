@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import threading
+import argparse
+import tempfile
+import platform
+import numpy as np
+
+#> Benchmarks the pipeline on synthetic WAVs, run from the repository root:
+#>   python benchmark.py --output bench.json
+#>   python benchmark.py --output bench.json --baseline bench_baseline.json
+#>   python benchmark.py --save-baseline bench_baseline.json
+
+SAMPLE_RATE = 16000
+
+
+#> Writes deterministic 16-bit PCM clips in the DCASE directory layout, so no dataset download is needed
+def generate_dataset(root_path, number_of_clips=32, seconds=10.0, machine_types=("fan", "valve"), seed=0):
+    generator = np.random.default_rng(seed)
+    time_axis = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    wav_paths = []
+
+    for machine_index, machine_type in enumerate(machine_types):
+        for split in ("train", "test"):
+            directory_path = os.path.join(root_path, "Development", machine_type, split)
+            os.makedirs(directory_path, exist_ok=True)
+
+            for i in range(number_of_clips // (2 * len(machine_types)) or 1):
+                label = "anomaly" if split == "test" and i % 2 else "normal"
+                domain = "target" if i % 4 == 3 else "source"
+
+                #> a machine "hum" (harmonics) plus noise, anomalies get an extra tone
+                frequency = 100 + 50 * machine_index
+                signal = sum(np.sin(2 * np.pi * frequency * harmonic * time_axis) / harmonic for harmonic in range(1, 5))
+                signal = signal + 0.3 * generator.standard_normal(len(time_axis))
+                if label == "anomaly":
+                    signal = signal + 0.5 * np.sin(2 * np.pi * 3000 * time_axis)
+                pcm = np.int16(np.clip(signal / np.max(np.abs(signal)), -1, 1) * 32767 * 0.8)
+
+                wav_path = os.path.join(directory_path, f"section_00_{domain}_{split}_{label}_{i:04d}_noAttribute.wav")
+                with wave.open(wav_path, 'wb') as wav_file:
+                    wav_file.setnchannels(1)
+                    wav_file.setsampwidth(2)
+                    wav_file.setframerate(SAMPLE_RATE)
+                    wav_file.writeframes(pcm.tobytes())
+                wav_paths.append(wav_path)
+
+    return wav_paths
+
+
+#> Current resident set size of this process, in MiB
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm", 'r') as file: #Linux, cheap enough to sample every few milliseconds
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (FileNotFoundError, OSError):
+        import psutil
+        return psutil.Process().memory_info().rss / 1024**2
+
+
+#> Samples the RSS in a background thread, so each stage gets its own peak instead of the process-wide ru_maxrss
+class RSSSampler:
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+
+    def __enter__(self):
+        self.start_rss_mb = current_rss_mb()
+        self.peak_rss_mb = self.start_rss_mb
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+        return False
+
+    def sample(self):
+        while not self.stopped.wait(self.interval_s):
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+
+class Benchmark:
+    def __init__(self, repeats=3):
+        self.repeats = repeats
+        self.results = {}
+
+
+    #> Runs function `repeats` times and keeps the fastest wall time, items is the amount of work (clips, frames, ...)
+    def measure(self, name, function, items=None, unit=None):
+        wall_times = []
+        result = None
+
+        with RSSSampler() as rss_sampler:
+            for _ in range(self.repeats):
+                start_time = time.perf_counter()
+                result = function()
+                wall_times.append(time.perf_counter() - start_time)
+
+        best_time = min(wall_times)
+        self.results[name] = {
+            'wall_time_s': best_time,
+            'wall_times_s': wall_times,
+            'peak_rss_mb': rss_sampler.peak_rss_mb, #highest RSS while this stage ran
+            'rss_growth_mb': rss_sampler.peak_rss_mb - rss_sampler.start_rss_mb, #how much memory the stage itself added
+        }
+        if items is not None:
+            self.results[name][f"{unit}_per_s"] = items / best_time if best_time > 0 else 0.0
+
+        print(f"{name:<32} {best_time * 1000:10.2f} ms" + (f" {items / best_time:12.1f} {unit}/s" if items is not None and best_time > 0 else ""))
+        return result
+
+
+def run(args):
+    import torch
+    import models
+    from audio_converter import AudioConverter
+    from data_bundler import DataBundler
+    from evaluator import Evaluator
+    from trainer import Trainer
+    from torch.utils.data import DataLoader
+
+    torch.manual_seed(0)
+    benchmark = Benchmark(repeats=args.repeats)
+    work_directory = tempfile.mkdtemp(prefix="benchmark_")
+
+    try:
+        root_path = os.path.join(work_directory, "DCASE-synthetic")
+        wav_paths = generate_dataset(root_path, number_of_clips=args.clips, seconds=args.seconds)
+        number_of_clips = len(wav_paths)
+
+        #> feature extraction
+        audio_converter = AudioConverter(audio_cache_size_mb=0) #otherwise every repeat after the first only measures cache hits
+        benchmark.measure("audio_converter.wav_to_input", lambda: [audio_converter.wav_to_input(wav_path) for wav_path in wav_paths], number_of_clips, "clips")
+
+        data_bundler = DataBundler(root_path=root_path, number_of_workers=args.workers, use_cache=False)
+        dataset, _, clip_lengths = benchmark.measure("data_bundler.load_dataset", lambda: data_bundler.load_dataset(shuffle=False), number_of_clips, "clips")
+        number_of_frames = len(dataset)
+
+        #> one training epoch of every model in models.py
+        for model_class in (models.BaselineAutoencoder, models.AF_Autoencoder):
+            def train_epoch():
+                trainer = Trainer(model_class(), device=args.device, save_directory=os.path.join(work_directory, "saved_models"), epochs=1)
+                return trainer.train_epoch(trainer.make_batches(dataset))
+            benchmark.measure(f"train_epoch.{model_class.__name__}", train_epoch, number_of_frames, "frames")
+
+        #> scoring
+        evaluator = Evaluator()
+        model = models.BaselineAutoencoder().to(args.device).eval()
+        testing_input_features = DataLoader(torch.from_numpy(np.asarray(dataset, dtype=np.float32)), batch_size=audio_converter.batch_size, shuffle=False)
+
+        clip_errors = benchmark.measure("evaluator.score_clips", lambda: evaluator.score_clips(model, testing_input_features, clip_lengths, args.device), number_of_frames, "frames")
+        benchmark.measure("evaluator.clip_errors", lambda: evaluator.clip_errors(dataset, dataset * 0.9, clip_lengths), number_of_frames, "frames")
+        benchmark.measure("evaluator.gamma_distribution", lambda: evaluator.gamma_distribution(clip_errors), len(clip_errors), "clips")
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'torch': torch.__version__,
+            'device': args.device,
+            'clips': args.clips,
+            'seconds': args.seconds,
+            'workers': args.workers,
+        },
+        'results': benchmark.results,
+    }
+
+
+#> Returns the stages whose wall time got slower than the baseline by more than `tolerance` (0.2 = 20 %)
+def compare(report, baseline, tolerance=0.2):
+    regressions = {}
+
+    print(f"\n{'stage':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in report['results'].items():
+        if name not in baseline.get('results', {}):
+            continue
+        baseline_time = baseline['results'][name]['wall_time_s']
+        change = result['wall_time_s'] / baseline_time - 1 if baseline_time > 0 else 0.0
+        flag = " REGRESSION" if change > tolerance else ""
+        print(f"{name:<32} {baseline_time * 1000:10.2f}ms {result['wall_time_s'] * 1000:10.2f}ms {change * 100:+7.1f}%{flag}")
+
+        if change > tolerance:
+            regressions[name] = change
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extraction, training, scoring and thresholding on synthetic data")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--save-baseline", help="also write the report to this path, to compare against later")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slow-down before a stage counts as a regression")
+    parser.add_argument("--clips", type=int, default=32, help="number of synthetic clips")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of every synthetic clip")
+    parser.add_argument("--workers", type=int, default=1, help="DataBundler worker processes")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per stage, the fastest one is reported")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--trace", help="also record instrumentation spans and write a Chrome trace / Perfetto JSON here")
+    args = parser.parse_args()
+
+    if args.trace:
+        import instrumentation
+        instrumentation.enable(synchronize_cuda=args.device != "cpu")
+
+    report = run(args)
+
+    if args.trace:
+        instrumentation.export_chrome_trace(args.trace)
+        print("\n" + instrumentation.summary())
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,122 +1,192 @@
 import os
-import glob
-import random
+import yaml
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 
+import instrumentation
 from audio_converter import AudioConverter
+from feature_cache import FeatureCache
+from feature_store import FeatureStore, FeatureStoreWriter
+from manifest import DatasetManifest
+
+#> every worker process builds its own AudioConverter once, in the pool initializer
+worker_audio_converter = None
+
+
+def initialise_worker():
+    global worker_audio_converter
+    worker_audio_converter = AudioConverter(audio_cache_size_mb=0) #every file is decoded once here, so reuse pooled buffers instead of caching PCM
+
+
+def extract_features(task):
+    file_path, mode, n = task #unpack the task (path to wav file, type of features, number of top frequencies)
+
+    audio_converter = worker_audio_converter
+    if audio_converter is None: #called outside of a pool (e.g. number_of_workers = 1)
+        initialise_worker()
+        audio_converter = worker_audio_converter
+
+    if mode == "input":
+        return audio_converter.wav_to_input(file_path)
+    elif mode == "input_with_freq":
+        return audio_converter.wav_to_input_with_freq(file_path, n=n)
+    else:
+        return audio_converter.wav_to_mel(file_path)
+
 
 class DataBundler:
-    def __init__(self, root_path="datasets/DCASE2025T2"):
+    def __init__(self, root_path="datasets/DCASE2025T2", number_of_workers=None, chunk_size=None, use_cache=None):
         # print("\nData Loader Here!")
         self.root_path = root_path
 
+        #> setup parallel feature extraction
+        self.loading_parameters = self.load_hyper_parameters().get('loading_parameters', {})
+        self.number_of_workers = number_of_workers if number_of_workers is not None else self.loading_parameters.get('number_of_workers', 1)
+        self.chunk_size = chunk_size if chunk_size is not None else self.loading_parameters.get('chunk_size', 16)
+
+        if not self.number_of_workers: #0 or None means use every available core
+            self.number_of_workers = os.cpu_count() or 1
+
+        #> setup the on-disk feature cache
+        self.cache_parameters = self.load_hyper_parameters().get('cache_parameters', {})
+        self.use_cache = use_cache if use_cache is not None else self.cache_parameters.get('use_cache', True)
+        self.feature_cache = FeatureCache() if self.use_cache else None
+
+        self.dataset_manifest = None #opened on first use
+
+
+    def load_hyper_parameters(self):
+        with open("hyper_parameters.yaml", 'r') as file:
+            return yaml.safe_load(file)
+
+
+    def load_dataset(self, inclusion_string=None, include_supplemental=True, percentage=1.0, shuffle=True, as_input=True, audio_type="all", store_directory=None, seed=None):
+        audio_files = self.find_audio_files(inclusion_string, include_supplemental, percentage, shuffle, audio_type, seed)
+
+        return self.process_audio_files(audio_files, "input" if as_input else "mel", store_directory=store_directory)
+
+
+    #> Loads the corpus once and also returns the machine type of every clip, for MultiModelTrainer
+    def load_dataset_by_machine_type(self, inclusion_string=None, include_supplemental=True, percentage=1.0, shuffle=True, audio_type="all", store_directory=None, seed=None):
+        rows = self.find_audio_rows(inclusion_string, include_supplemental, percentage, shuffle, audio_type, seed)
+        audio_files = [row['path'] for row in rows]
+        machine_types = [row['machine_type'] for row in rows] #as parsed once by the manifest
+
+        dataset, filenames, all_clip_lengths = self.process_audio_files(audio_files, "input", store_directory=store_directory)
+
+        return dataset, filenames, all_clip_lengths, machine_types
+
+
+    #> Selects files through the dataset manifest instead of walking the tree, sampling `percentage` per stratum
+    #> a seed makes the subset and order reproducible, without one they follow the global random.seed()
+    def find_audio_files(self, inclusion_string=None, include_supplemental=True, percentage=1.0, shuffle=True, audio_type="all", seed=None):
+        return [row['path'] for row in self.find_audio_rows(inclusion_string, include_supplemental, percentage, shuffle, audio_type, seed)]
+
+
+    #> Like find_audio_files, but returns the manifest rows (path, machine_type, split, domain, label, ...)
+    def find_audio_rows(self, inclusion_string=None, include_supplemental=True, percentage=1.0, shuffle=True, audio_type="all", seed=None):
+        with instrumentation.span("bundler.find_audio_files"):
+            manifest = self.manifest()
+            rows = manifest.select(
+                labels=audio_type if audio_type in ("normal", "anomaly") else None,
+                inclusion_string=inclusion_string,
+                include_supplemental=include_supplemental,
+            )
+            return manifest.sample(rows, percentage=percentage, shuffle=shuffle, seed=seed)
+
+
+    #> Opens (and incrementally refreshes) the manifest once per DataBundler
+    def manifest(self):
+        if self.dataset_manifest is None:
+            self.dataset_manifest = DatasetManifest(self.root_path)
+            self.dataset_manifest.refresh()
+        return self.dataset_manifest
+
+
+    def load_dataset_with_freq(self, inclusion_string=None, percentage=1.0, shuffle=True, as_input=True, audio_type="all", n=10, store_directory=None, seed=None):
+        audio_files = self.find_audio_files(inclusion_string, False, percentage, shuffle, audio_type, seed)
+
+        return self.process_audio_files(audio_files, "input_with_freq" if as_input else "mel", n=n, store_directory=store_directory)
+
+
+    #> Extracts the features of every file, either stacked in memory or packed into a memory-mapped feature store
+    def process_audio_files(self, audio_files, mode="input", n=10, store_directory=None):
+        filenames = [os.path.basename(file_path) for file_path in audio_files]
+
+        if store_directory is not None:
+            #> rows are streamed to disk one clip at a time, so the dataset is never held in RAM
+            with FeatureStoreWriter(store_directory) as writer:
+                for filename, (clip_lengths, input_features) in zip(filenames, self.iterate_features(audio_files, mode, n)):
+                    writer.append(filename, clip_lengths, input_features)
+
+            feature_store = FeatureStore(store_directory)
+            dataset = feature_store.features #np.memmap, pass it to FeatureStoreDataset instead of torch.tensor to avoid a copy
+            all_clip_lengths = feature_store.clip_lengths
+        else:
+            all_input_features = []
+            all_clip_lengths = []
+
+            for clip_lengths, input_features in self.iterate_features(audio_files, mode, n):
+                all_input_features.append(input_features)
+                all_clip_lengths.append(clip_lengths)
+
+            with instrumentation.span("bundler.vstack"):
+                dataset = np.vstack(all_input_features) #stack all input features into a single array
+            all_clip_lengths = np.array(all_clip_lengths)
 
-    def load_dataset(self, inclusion_string=None, include_supplemental=True, percentage=1.0, shuffle=True, as_input=True, audio_type="all"):
-        audio_files = []
-        # for directory_path, _, filenames in os.walk(self.root_path):
-        #     if inclusion_string is None or inclusion_string in directory_path:
-        #         if include_supplemental == False and "supplemental" in directory_path:
-        #             continue
-
-        for directory_path, _, filenames in os.walk(self.root_path):
-            if include_supplemental and "supplemental" in directory_path:
-                files = glob.glob(os.path.join(directory_path, '*.wav'))
-            elif inclusion_string is None or inclusion_string in directory_path:
-                files = glob.glob(os.path.join(directory_path, '*.wav'))
-            else:
-                continue
-                
-            files = glob.glob(os.path.join(directory_path, '*.wav'))
-            
-            if audio_type == "normal":
-                filtered_files = [file for file in files if "normal" in os.path.basename(file)]
-            elif audio_type == "anomaly":
-                filtered_files = [file for file in files if "anomaly" in os.path.basename(file)]
-            else:
-                filtered_files = files
-            
-            audio_files.extend(filtered_files)
-
-        if shuffle:
-            random.shuffle(audio_files)  # Shuffle the list if `shuffle` is True
-            #print(f"Shuffled {len(audio_files)} files")
-
-        number_of_files = len(audio_files) #get number of files in dataset
-        files_to_process = int(percentage * number_of_files) #get number of files to process
-        audio_files = audio_files[:files_to_process]
-
-        audio_converter = AudioConverter()
-        all_input_features = []
-        all_clip_lengths = []
-        filenames = []
-
-        for i, file_path in enumerate(tqdm(audio_files, desc="Processing audio files", unit="file"), 1):
-            #print(f"({i}/{files_to_process}) Processing '{os.path.basename(file_path)}'")
-            if as_input:
-                clip_lengths, input_features = audio_converter.wav_to_input(file_path)
-            else:
-                clip_lengths, input_features = audio_converter.wav_to_mel(file_path)
-
-            all_input_features.append(input_features)
-            all_clip_lengths.append(clip_lengths)
-            filenames.append(os.path.basename(file_path))
-
-        dataset = np.vstack(all_input_features) #stack all input features into a single array
-        all_clip_lengths = np.array(all_clip_lengths)
         print(f"Done loading!")
         print(f"Length of dataset: {len(dataset)}\n")
 
         return dataset, filenames, all_clip_lengths
 
 
-    def load_dataset_with_freq(self, inclusion_string=None, percentage=1.0, shuffle=True, as_input=True, audio_type="all", n=10):
-        audio_files = []
-        for directory_path, _, filenames in os.walk(self.root_path):
-            if inclusion_string is None or inclusion_string in directory_path:
-                files = glob.glob(os.path.join(directory_path, '*.wav'))
-                
-                if audio_type == "normal":
-                    filtered_files = [file for file in files if "normal" in os.path.basename(file)]
-                elif audio_type == "anomaly":
-                    filtered_files = [file for file in files if "anomaly" in os.path.basename(file)]
+    #> Yields (clip_lengths, input_features) for every file in order, reading cached features and computing only the missing ones
+    def iterate_features(self, audio_files, mode="input", n=10):
+        missing_indices = [i for i, file_path in enumerate(audio_files) if self.feature_cache is None or not self.feature_cache.contains(file_path, mode, n)]
+        missing = set(missing_indices)
+
+        if self.feature_cache is not None:
+            print(f"Feature cache: {len(audio_files) - len(missing_indices)} hits, {len(missing_indices)} misses")
+            instrumentation.count("bundler.cache_hits", len(audio_files) - len(missing_indices))
+            instrumentation.count("bundler.cache_misses", len(missing_indices))
+
+        tasks = [(audio_files[i], mode, n) for i in missing_indices]
+        progress_bar = tqdm(total=len(audio_files), desc="Processing audio files", unit="file")
+
+        executor = None
+        if self.number_of_workers > 1 and len(tasks) > 1:
+            #> executor.map yields results in submission order, so the output order is deterministic
+            executor = ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=initialise_worker)
+            computed = executor.map(extract_features, tasks, chunksize=self.chunk_size)
+        else:
+            computed = map(extract_features, tasks)
+
+        try:
+            for i, file_path in enumerate(audio_files):
+                if i in missing:
+                    with instrumentation.span("bundler.extract"): #waiting for the workers, or extracting in this process
+                        clip_lengths, input_features = next(computed)
+                    self.cache_features(file_path, input_features, mode, n)
                 else:
-                    filtered_files = files
-                
-                audio_files.extend(filtered_files)
-
-        if shuffle:
-            random.shuffle(audio_files)  # Shuffle the list if `shuffle` is True
-            #print(f"Shuffled {len(audio_files)} files")
-
-        number_of_files = len(audio_files) #get number of files in dataset
-        files_to_process = int(percentage * number_of_files) #get number of files to process
-        audio_files = audio_files[:files_to_process]
-
-        audio_converter = AudioConverter()
-        all_input_features = []
-        all_clip_lengths = []
-        filenames = []
-
-        for i, file_path in enumerate(tqdm(audio_files, desc="Processing audio files", unit="file"), 1):
-            #print(f"({i}/{files_to_process}) Processing '{os.path.basename(file_path)}'")
-            if as_input:
-                clip_lengths, input_features = audio_converter.wav_to_input_with_freq(file_path, n=n)
-            else:
-                clip_lengths, input_features = audio_converter.wav_to_mel(file_path)
-
-            all_input_features.append(input_features)
-            all_clip_lengths.append(clip_lengths)
-            filenames.append(os.path.basename(file_path))
-
-        dataset = np.vstack(all_input_features) #stack all input features into a single array
-        all_clip_lengths = np.array(all_clip_lengths)
-        print(f"Done loading!")
-        print(f"Length of dataset: {len(dataset)}\n")
+                    with instrumentation.span("bundler.cache_read"):
+                        cached = self.feature_cache.get(file_path, mode, n)
+                    clip_lengths, input_features = cached if cached is not None else extract_features((file_path, mode, n)) #evicted in the meantime
+
+                progress_bar.update(1)
+                yield clip_lengths, input_features
+        finally:
+            progress_bar.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+
+    def cache_features(self, file_path, input_features, mode="input", n=10):
+        if self.feature_cache is not None:
+            with instrumentation.span("bundler.cache_write"):
+                self.feature_cache.put(file_path, input_features, mode, n)
 
-        return dataset, filenames, all_clip_lengths
 
-    
 # data_bundler = DataBundler()
 # clip_lengths, dataset, filenames = data_bundler.load_dataset_with_freq('ToyCar\\train', 0.001, True, True)
 # print(clip_lengths)
\ No newline at end of file
@@ -1,17 +1,26 @@
 import os #library for interacting with the operating system
+import hashlib #library for computing checksums
 import requests #library for making http requests
 import yaml #library for parsing and writing YAML files
 
-from zipfile import ZipFile #library for working with ZIP files
+from zipfile import ZipFile, BadZipFile #library for working with ZIP files
 from tqdm import tqdm #library for creating progress bars
+from concurrent.futures import ThreadPoolExecutor, as_completed #library for running downloads concurrently
 
 class DatasetDownloader:
-    def __init__(self, base_directory="datasets"): #constructor
+    def __init__(self, base_directory="datasets", max_parallel_downloads=4, chunk_size=1024 * 1024, timeout=60, feature_store_directory=None, keep_raw=True): #constructor
         self.base_directory = base_directory #directory where the datasets will be stored
         os.makedirs(self.base_directory, exist_ok=True) #create the base directory if it doesn't exist
 
-    #> Downloads a file from the given URL and saves it to the target directory
-    def download_file(self, url, target_directory, filename=None):
+        self.max_parallel_downloads = max_parallel_downloads #number of files downloaded at the same time
+        self.chunk_size = chunk_size #size of the chunks written to disk (1 MiB)
+        self.timeout = timeout #seconds to wait for the server before giving up
+
+        self.feature_store_directory = feature_store_directory #if set, features are computed straight from the archives into feature stores here
+        self.keep_raw = keep_raw #whether the WAV files are still extracted to disk when feature stores are written
+
+    #> Downloads a file from the given URL and saves it to the target directory, resuming a partial download if there is one
+    def download_file(self, url, target_directory, filename=None, checksum=None):
         os.makedirs(target_directory, exist_ok=True) #ensure the target directory exists
         
         #> if no filename is provided, extract it from the URL
@@ -19,29 +28,114 @@ class DatasetDownloader:
             filename = os.path.basename(url)
 
         file_path = os.path.join(target_directory, filename) #full path for the downloaded file
+        partial_path = file_path + ".part" #the download only gets its real name once it has been verified
 
         #> if the file already exists, notify the user and return the file path
         if os.path.exists(file_path):
             print(f"File already exists: {file_path}")
             return file_path 
-        
-        response = requests.get(url, stream=True) #make an HTTP GET request to download the file
-        total_size = int(response.headers.get('content-length', 0)) #get the total file size
-
-        #> open the file for writing (in binary mode, wb) and show a progress bar
-        with open(file_path, 'wb') as file, tqdm(
-            desc=f"Downloading {filename}", #label for the progress bar
-            total=total_size, #total size of the file, for the progress bar
-            unit='B', #unit of measurement for the progress bar (B for bytes)
-            unit_scale=True, #scale hte unit (e.g., KB, MB, GB)
-            unit_divisor=1024, #divisor for scaling the unit (1024 for binary)
-        ) as bar:
-            for chunk in response.iter_content(chunk_size=1024): #download in chunks of 1024 bytes
-                file.write(chunk) #write each chunk to the file
-                bar.update(len(chunk)) #update the progress bar
+
+        downloaded_size = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0 #bytes left over from an interrupted run
+        headers = {'Range': f"bytes={downloaded_size}-"} if downloaded_size > 0 else {} #ask the server for the rest of the file only
+
+        with requests.get(url, stream=True, headers=headers, timeout=self.timeout) as response: #make an HTTP GET request to download the file
+            if response.status_code == 416: #nothing left after downloaded_size, only fine if the server's size is exactly ours
+                _, _, total_size = self.parse_content_range(response.headers.get('content-range'))
+                if total_size != downloaded_size: #larger than the real file or part of a different one
+                    return self.restart_download(url, target_directory, filename, checksum, partial_path)
+                mode = 'ab'
+            else:
+                response.raise_for_status() #stop on 404, 500, ...
+
+                if response.status_code == 206: #the server supports Range requests, continue where we stopped
+                    start, _, total_size = self.parse_content_range(response.headers.get('content-range'))
+                    if start != downloaded_size: #appending would corrupt the file
+                        return self.restart_download(url, target_directory, filename, checksum, partial_path)
+                    mode = 'ab'
+                else: #the server sent the whole file, start over
+                    downloaded_size = 0
+                    total_size = int(response.headers.get('content-length', 0)) #get the total file size
+                    mode = 'wb'
+
+            #> open the file for writing (in binary mode) and show a progress bar
+            with open(partial_path, mode) as file, tqdm(
+                desc=f"Downloading {filename}", #label for the progress bar
+                total=total_size, #total size of the file, for the progress bar
+                initial=downloaded_size, #bytes that were already downloaded before
+                unit='B', #unit of measurement for the progress bar (B for bytes)
+                unit_scale=True, #scale hte unit (e.g., KB, MB, GB)
+                unit_divisor=1024, #divisor for scaling the unit (1024 for binary)
+                leave=False, #remove the bar when done, several downloads share the terminal
+            ) as bar:
+                if response.status_code != 416:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size): #download in large buffered chunks
+                        file.write(chunk) #write each chunk to the file
+                        bar.update(len(chunk)) #update the progress bar
+
+        if checksum is None:
+            checksum = self.zenodo_checksum(url) #Zenodo publishes an md5 for every file
+
+        self.verify_file(partial_path, total_size, checksum) #make sure the file is complete before anyone uses it
+        os.replace(partial_path, file_path) #give the verified file its real name
 
         return file_path #return the path of the downloaded file
 
+    #> Parses "bytes START-END/TOTAL" (206) or "bytes */TOTAL" (416) into (start, end, total), unknown parts are None
+    @staticmethod
+    def parse_content_range(content_range):
+        if not content_range or not content_range.startswith("bytes "):
+            return None, None, None
+
+        byte_range, _, total = content_range[len("bytes "):].partition("/")
+        total = int(total) if total.isdigit() else None
+        if byte_range == "*":
+            return None, None, total
+
+        start, _, end = byte_range.partition("-")
+        return int(start), int(end), total
+
+    #> Throws away a partial file that does not match the one on the server and downloads it from the start
+    def restart_download(self, url, target_directory, filename, checksum, partial_path):
+        print(f"Partial download does not match the server, starting over: {partial_path}")
+        os.remove(partial_path)
+        return self.download_file(url, target_directory, filename, checksum) #no Range header this time, so this does not recurse again
+
+    #> Looks up "md5:..." of a https://zenodo.org/records/<id>/files/<name> URL, None for other URLs or when the lookup fails
+    def zenodo_checksum(self, url):
+        parts = url.split("/")
+        if "zenodo.org" not in url or "records" not in parts or "files" not in parts:
+            return None
+
+        record_id = parts[parts.index("records") + 1]
+        filename = parts[parts.index("files") + 1]
+        try:
+            response = requests.get(f"https://zenodo.org/api/records/{record_id}", timeout=self.timeout)
+            response.raise_for_status()
+            files = response.json().get('files', [])
+        except (requests.RequestException, ValueError) as e:
+            print(f"Could not look up the checksum of {filename}, only its size is verified ({e})")
+            return None
+
+        return next((file['checksum'] for file in files if file.get('key') == filename), None)
+
+    #> Checks the size and (if known) the checksum of a downloaded file, a corrupt file is deleted so the next run starts over
+    def verify_file(self, file_path, expected_size=None, checksum=None):
+        actual_size = os.path.getsize(file_path)
+        if expected_size and actual_size != expected_size:
+            raise IOError(f"Incomplete download: {file_path} has {actual_size} of {expected_size} bytes") #keep the partial file, the next run resumes it
+
+        if checksum is not None:
+            algorithm, expected_digest = checksum.split(":", 1) if ":" in checksum else ("md5", checksum) #e.g. "md5:0123..." like Zenodo reports it
+            digest = hashlib.new(algorithm)
+
+            with open(file_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                    digest.update(chunk)
+
+            if digest.hexdigest() != expected_digest.lower():
+                os.remove(file_path)
+                raise IOError(f"Checksum mismatch for {file_path}: expected {expected_digest}, got {digest.hexdigest()}")
+
     #> Extracts a ZIP file to the specified directory
     def extract_zip(self, zip_path, extract_to=None):
         #> if not extraction directory is specified, use the zip file name (without extension) as the directory
@@ -49,15 +143,29 @@ class DatasetDownloader:
             extract_to = os.path.splitext(zip_path)[0]
 
         #> open the ZIP file and extract all its contents to the target directory
-        with ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
+        try:
+            with ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(extract_to)
+        except BadZipFile:
+            os.remove(zip_path) #a corrupt archive is downloaded again on the next run
+            raise
 
         return extract_to #return the directory where the files were extracted to
 
     #> Downloads a ZIP file from the given URL and extracts it to the target directory
-    def download_and_extract(self, url, target_directory):
-        zip_path = self.download_file(url, target_directory) #download the ZIP file
-        extract_path = self.extract_zip(zip_path, target_directory) #extract the contents of the ZIP file
+    def download_and_extract(self, url, target_directory, checksum=None):
+        zip_path = self.download_file(url, target_directory, checksum=checksum) #download the ZIP file
+        return self.extract_and_remove(zip_path, target_directory)
+
+    def extract_and_remove(self, zip_path, target_directory):
+        if self.feature_store_directory is not None: #one pass over the archive: decode the WAV members in memory and store their features
+            from zip_ingester import ZipIngester #only needed (and only imports librosa/torch) when ingesting
+
+            store_directory = os.path.join(self.feature_store_directory, os.path.relpath(target_directory, self.base_directory), os.path.splitext(os.path.basename(zip_path))[0])
+            ZipIngester().ingest(zip_path, store_directory, extract_to=target_directory if self.keep_raw else None)
+            extract_path = target_directory if self.keep_raw else store_directory
+        else:
+            extract_path = self.extract_zip(zip_path, target_directory) #extract the contents of the ZIP file
 
         os.remove(zip_path)  # Delete the zip file after extraction
 
@@ -70,12 +178,51 @@ class DatasetDownloader:
         with open(yaml_file, 'r') as file:
             data = yaml.safe_load(file)
 
-        #> iterate through the YAML data hierarchy
+        #> iterate through the YAML data hierarchy and collect one job per archive
+        jobs = []
         for challenge_name, datasets in data.items(): #iterate through challenges
-            for dataset_type, urls in datasets.items(): #iterate through dataset types
-                for url in urls: #iterate through URLs and build the target directory structure
+            for dataset_type, entries in datasets.items(): #iterate through dataset types
+                for entry in entries: #iterate through URLs and build the target directory structure
                     target_directory = os.path.join(self.base_directory, challenge_name, dataset_type)
-                    self.download_and_extract(url, target_directory) #download and extract the dataset
+
+                    if isinstance(entry, dict): #{url: ..., checksum: "md5:..."}
+                        jobs.append((entry['url'], target_directory, entry.get('checksum')))
+                    else: #plain URL
+                        jobs.append((entry, target_directory, None))
+
+        return self.download_and_extract_all(jobs)
+
+    #> Downloads several archives at once and extracts each one while the next ones are still downloading
+    def download_and_extract_all(self, jobs):
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_downloads) as download_pool, ThreadPoolExecutor(max_workers=1) as extract_pool: #extraction is disk bound, one at a time
+            downloads = {download_pool.submit(self.download_file, url, target_directory, None, checksum): (url, target_directory) for url, target_directory, checksum in jobs}
+
+            extractions = []
+            for download in as_completed(downloads): #every finished archive is queued for extraction right away
+                url, target_directory = downloads[download]
+                try:
+                    zip_path = download.result()
+                except Exception as e:
+                    errors.append((url, e))
+                    continue
+                extractions.append((url, extract_pool.submit(self.extract_and_remove, zip_path, target_directory)))
+
+            extract_paths = []
+            for url, extraction in extractions:
+                try:
+                    extract_paths.append(extraction.result())
+                except Exception as e:
+                    errors.append((url, e))
+
+        for url, e in errors:
+            print(f"Failed: {url} ({e})") #notify the user about every archive that has to be downloaded again
+
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(jobs)} datasets failed, run the download again to resume them")
+
+        return extract_paths
     
     def download_datasets(self, yaml_file_path):
         while True:
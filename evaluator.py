@@ -4,6 +4,8 @@ import numpy as np
 from scipy.stats import gamma
 from torch.nn.functional import mse_loss
 
+import instrumentation
+
 class Evaluator:
     def __init__(self):
         pass
@@ -26,35 +28,93 @@ class Evaluator:
 
         with torch.no_grad():
             for data in input_data:
-                input = data.to(device)
-                output = model(input)
+                with instrumentation.span("evaluator.host_to_device"):
+                    input = data.to(device)
+                with instrumentation.span("evaluator.forward"):
+                    output = model(input)
 
-                output_features.append(output.cpu().numpy())
+                with instrumentation.span("evaluator.device_to_host"):
+                    output_features.append(output.cpu().numpy())
 
                 mse = mse_loss(output, input, reduction='sum').item()
                 mse_list.append(mse)
                 total_mse += mse
-                total_samples += input.numel()
+                number_of_samples += input.numel()
         
         average_mse = total_mse / number_of_samples
 
         return output_features, average_mse
 
 
-    def bundle(self, data, clip_lengths):
-        clips = []
+    #> Streams the test set through the model and only keeps per-clip scores, input_data must not be shuffled
+    def score_clips(self, model, input_data, clip_lengths, device, keep_reconstructions=False):
+        clip_lengths = torch.as_tensor(np.asarray(clip_lengths), dtype=torch.int64, device=device)
+        offsets = torch.cumsum(clip_lengths, dim=0) #end index of every clip
+        clip_sums = torch.zeros(len(clip_lengths), dtype=torch.float64, device=device)
+        output_features = [] if keep_reconstructions else None
 
+        model.eval()
         start_index = 0
+        number_of_features = 0
+
+        with torch.no_grad():
+            for data in input_data:
+                with instrumentation.span("evaluator.host_to_device"):
+                    input = data.to(device, non_blocking=True)
+                with instrumentation.span("evaluator.forward"):
+                    output = model(input)
+
+                #> per-frame squared error, scattered into the sum of the clip each frame belongs to
+                with instrumentation.span("evaluator.score"):
+                    frame_errors = (output - input).pow(2).sum(dim=1).to(torch.float64)
+                    frame_indices = torch.arange(start_index, start_index + len(input), device=device)
+                    clip_indices = torch.searchsorted(offsets, frame_indices, right=True)
+                    clip_sums.index_add_(0, clip_indices, frame_errors)
+
+                if keep_reconstructions:
+                    output_features.append(output.cpu().numpy())
+
+                start_index += len(input)
+                number_of_features = input.shape[1]
 
-        for size in clip_lengths:
-            end_index = start_index + size
-            clips.append(data[start_index:end_index])
-            start_index = end_index
+        clip_errors = clip_sums / (clip_lengths.to(torch.float64) * number_of_features) #same value as mse on the bundled clips
+        clip_errors = clip_errors.cpu().numpy()
+
+        if keep_reconstructions:
+            return clip_errors, self.bundle(np.vstack(output_features), clip_lengths.cpu().numpy())
+
+        return clip_errors
+
+
+    def bundle(self, data, clip_lengths):
+        offsets = self.clip_offsets(clip_lengths)
+        clips = np.split(data, offsets[1:-1]) #list of views into data, no copies
 
         return clips
+
+
+    #> Start index of every clip in the stacked array, plus the total number of frames at the end
+    def clip_offsets(self, clip_lengths):
+        return np.concatenate(([0], np.cumsum(clip_lengths, dtype=np.int64)))
+
+
+    #> Sums consecutive segments of values (one segment per clip) with a single np.add.reduceat call
+    def segment_sum(self, values, clip_lengths):
+        clip_lengths = np.asarray(clip_lengths)
+        offsets = self.clip_offsets(clip_lengths)
+
+        sums = np.zeros((len(clip_lengths),) + values.shape[1:], dtype=np.float64)
+        non_empty = clip_lengths > 0
+        if np.any(non_empty):
+            sums[non_empty] = np.add.reduceat(values, offsets[:-1][non_empty], axis=0) #empty clips contribute nothing to their neighbours
+
+        return sums
     
 
-    def reconstruction_error(self, original, reconstructed):
+    def reconstruction_error(self, original, reconstructed, clip_lengths=None):
+        if clip_lengths is not None: #stacked arrays, use the vectorised path
+            return self.clip_errors(original, reconstructed, clip_lengths)
+
         recon_err_per_clip = self.mse(original, reconstructed)
 
         return recon_err_per_clip
@@ -70,10 +130,35 @@ class Evaluator:
             error_array.append(np.mean((original_sample - reconstructed_sample)**2))
         
         return error_array
+
+
+    #> Mean squared error of every frame of the stacked (frames, features) arrays, reduced in blocks of block_size rows
+    #> so the extra memory is one block, not a dataset-sized difference array
+    def frame_errors(self, original, reconstructed, block_size=65536):
+        original = np.asarray(original)
+        reconstructed = np.asarray(reconstructed)
+        frame_errors = np.empty(len(original), dtype=np.float64)
+
+        for start_index in range(0, len(original), block_size):
+            difference = original[start_index:start_index + block_size] - reconstructed[start_index:start_index + block_size]
+            frame_errors[start_index:start_index + block_size] = np.einsum('ij,ij->i', difference, difference, dtype=np.float64)
+
+        return frame_errors / original.shape[1]
+
+
+    #> Mean squared error of every clip, computed directly on the stacked arrays (same values as mse on the bundled clips)
+    def clip_errors(self, original, reconstructed, clip_lengths):
+        with instrumentation.span("evaluator.clip_errors"):
+            clip_lengths = np.asarray(clip_lengths)
+            frame_errors = self.frame_errors(original, reconstructed)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return self.segment_sum(frame_errors, clip_lengths) / clip_lengths
         
 
     def gamma_distribution(self, error):
-        shape, location, scale = gamma.fit(error)
+        with instrumentation.span("evaluator.gamma_fit"):
+            shape, location, scale = gamma.fit(error)
 
         x = np.linspace(0, max(error), 1000)
         gamma_pdf = gamma.pdf(x, shape, loc=location, scale=scale)
@@ -83,5 +168,12 @@ class Evaluator:
         return gamma_pdf, anomaly_threshold
 
 
+    #> Only the threshold, without evaluating the pdf that gamma_distribution computes for plotting
+    def gamma_threshold(self, error, percentile=0.9):
+        shape, location, scale = gamma.fit(error)
+
+        return gamma.ppf(percentile, shape, loc=location, scale=scale)
+
+
     def make_predictions(self, values, threshold):
         return (values > threshold).astype(int)
\ No newline at end of file
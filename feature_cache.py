@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import yaml
+import hashlib
+import numpy as np
+
+class FeatureCache:
+    def __init__(self, cache_directory=None, max_size_gb=None):
+        self.hyper_parameters = self.load_hyper_parameters()
+
+        #> the acoustic features are part of every key, so changing them invalidates the cache
+        self.acoustic_features = self.hyper_parameters['acoustic_features']
+
+        #> setup cache location and size cap
+        self.cache_parameters = self.hyper_parameters.get('cache_parameters', {})
+        self.cache_directory = cache_directory if cache_directory is not None else self.cache_parameters.get('cache_directory', 'feature_cache')
+        self.max_size_gb = max_size_gb if max_size_gb is not None else self.cache_parameters.get('max_size_gb', 20)
+        self.max_size_bytes = int(self.max_size_gb * 1024**3)
+        self.low_water_bytes = int(0.9 * self.max_size_bytes) #evict down to this, so a full cache is not rescanned on every put
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        #> in-memory index path -> (size, last access), the directory is only walked once here
+        self.index = {file_path: (size, last_access) for file_path, size, last_access in self.entries()}
+        self.current_size_bytes = sum(size for size, _ in self.index.values())
+
+
+    def load_hyper_parameters(self):
+        with open("hyper_parameters.yaml", 'r') as file:
+            return yaml.safe_load(file)
+
+
+    #> Builds the content address of a feature array from the file identity and the acoustic parameters
+    def key(self, wav_path, mode="input", n=10):
+        stat = os.stat(wav_path)
+        description = {
+            'path': os.path.abspath(wav_path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'acoustic_features': self.acoustic_features,
+            'mode': mode,
+            'n': n if mode == "input_with_freq" else None,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.cache_directory, key[:2], f"{key}.npy") #shard by prefix to keep directories small
+
+
+    def contains(self, wav_path, mode="input", n=10):
+        return os.path.exists(self.path(self.key(wav_path, mode, n)))
+
+
+    #> Returns (clip_length, features) like AudioConverter does, or None on a cache miss
+    def get(self, wav_path, mode="input", n=10):
+        cache_path = self.path(self.key(wav_path, mode, n))
+
+        try:
+            features = np.load(cache_path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        os.utime(cache_path) #touch the entry so eviction treats it as recently used
+        if cache_path in self.index:
+            self.index[cache_path] = (self.index[cache_path][0], time.time())
+        else: #written by another process since the index was built
+            self.index[cache_path] = (os.path.getsize(cache_path), time.time())
+            self.current_size_bytes += self.index[cache_path][0]
+
+        clip_length = features.shape[1] if mode == "mel" else features.shape[0]
+        return clip_length, features
+
+
+    def put(self, wav_path, features, mode="input", n=10):
+        cache_path = self.path(self.key(wav_path, mode, n))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        #> write to a temporary file first so an interrupted run never leaves a truncated entry
+        temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.save(file, features)
+        os.replace(temporary_path, cache_path)
+
+        size = os.path.getsize(cache_path)
+        previous_size, _ = self.index.get(cache_path, (0, None))
+        self.index[cache_path] = (size, time.time())
+        self.current_size_bytes += size - previous_size
+        if self.current_size_bytes > self.max_size_bytes:
+            self.evict()
+
+
+    #> Lists (path, size, last access) for every entry on disk
+    def entries(self):
+        entries = []
+        for directory_path, _, filenames in os.walk(self.cache_directory):
+            for filename in filenames:
+                if filename.endswith('.npy'):
+                    file_path = os.path.join(directory_path, filename)
+                    stat = os.stat(file_path)
+                    entries.append((file_path, stat.st_size, stat.st_mtime))
+        return entries
+
+
+    #> Removes the least recently used entries until the cache is back under its low-water mark
+    def evict(self):
+        for file_path, (size, _) in sorted(self.index.items(), key=lambda entry: entry[1][1]):
+            if self.current_size_bytes <= self.low_water_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            del self.index[file_path]
+            self.current_size_bytes -= size
+
+
+    def clear(self):
+        for file_path, _, _ in self.entries():
+            os.remove(file_path)
+        self.index = {}
+        self.current_size_bytes = 0
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import json
+import torch
+import numpy as np
+from torch.utils.data import Dataset
+
+#> A feature store is a directory holding:
+#>   features.f32      every clip's rows packed into one contiguous raw float32 matrix
+#>   offsets.npy       row offset of each clip into the matrix (length number_of_clips + 1)
+#>   clip_lengths.npy  clip lengths as returned by AudioConverter
+#>   index.json        matrix shape, the filename table and optional per-clip metadata (labels, section, domain, ...)
+
+class FeatureStoreWriter:
+    def __init__(self, store_directory):
+        self.store_directory = store_directory
+        os.makedirs(self.store_directory, exist_ok=True)
+
+        #> index.json is written last and marks the store as complete, so drop the one of a store being overwritten
+        index_path = os.path.join(self.store_directory, 'index.json')
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        self.features_file = open(os.path.join(self.store_directory, 'features.f32'), 'wb')
+        self.number_of_rows = 0
+        self.number_of_columns = None
+        self.offsets = [0]
+        self.clip_lengths = []
+        self.filenames = []
+        self.metadata = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort() #a truncated store must not open as if it were complete
+
+
+    #> Appends the rows of one clip to the end of the packed matrix
+    def append(self, filename, clip_length, features, metadata=None):
+        features = np.ascontiguousarray(features, dtype=np.float32)
+
+        if self.number_of_columns is None:
+            self.number_of_columns = features.shape[1]
+        elif features.shape[1] != self.number_of_columns:
+            raise ValueError(f"Expected {self.number_of_columns} columns, got {features.shape[1]} for '{filename}'")
+
+        self.features_file.write(features.tobytes())
+        self.number_of_rows += features.shape[0]
+        self.offsets.append(self.number_of_rows)
+        self.clip_lengths.append(clip_length)
+        self.filenames.append(filename)
+        self.metadata.append(metadata or {})
+
+
+    #> Writes the index files; the store can only be opened after this
+    def close(self):
+        if self.features_file.closed:
+            return
+        self.features_file.close()
+
+        np.save(os.path.join(self.store_directory, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        np.save(os.path.join(self.store_directory, 'clip_lengths.npy'), np.array(self.clip_lengths, dtype=np.int64))
+
+        index_path = os.path.join(self.store_directory, 'index.json')
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump({
+                'shape': [self.number_of_rows, self.number_of_columns or 0],
+                'dtype': 'float32',
+                'filenames': self.filenames,
+                'metadata': self.metadata,
+            }, file)
+        os.replace(index_path + '.tmp', index_path)
+
+
+    #> Discards a store that was not written completely, no index is written
+    def abort(self):
+        if not self.features_file.closed:
+            self.features_file.close()
+
+        for filename in ('features.f32', 'offsets.npy', 'clip_lengths.npy'):
+            try:
+                os.remove(os.path.join(self.store_directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+
+class FeatureStore:
+    def __init__(self, store_directory):
+        self.store_directory = store_directory
+
+        with open(os.path.join(self.store_directory, 'index.json'), 'r') as file:
+            index = json.load(file)
+
+        self.shape = tuple(index['shape'])
+        self.filenames = index['filenames']
+        self.metadata = index.get('metadata', [{} for _ in self.filenames])
+        self.offsets = np.load(os.path.join(self.store_directory, 'offsets.npy'))
+        self.clip_lengths = np.load(os.path.join(self.store_directory, 'clip_lengths.npy'))
+
+        #> copy-on-write keeps the pages shared with the file, but gives torch.from_numpy a writable array
+        if self.shape[0] > 0:
+            self.features = np.memmap(os.path.join(self.store_directory, 'features.f32'), dtype=np.float32, mode='c', shape=self.shape)
+        else:
+            self.features = np.empty(self.shape, dtype=np.float32)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    @property
+    def number_of_clips(self):
+        return len(self.filenames)
+
+
+    #> Returns the rows of a single clip as a view into the memory map
+    def clip(self, i):
+        return self.features[self.offsets[i]:self.offsets[i + 1]]
+
+
+
+class FeatureStoreDataset(Dataset):
+    def __init__(self, feature_store):
+        if isinstance(feature_store, str):
+            feature_store = FeatureStore(feature_store)
+        self.store_directory = feature_store.store_directory
+        self.number_of_rows = len(feature_store)
+        self.features = feature_store.features
+
+
+    #> Only the directory is pickled, a pickled memmap carries the whole matrix into every spawned DataLoader worker
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['features'] = None
+        return state
+
+
+    def __len__(self):
+        return self.number_of_rows
+
+
+    def __getitem__(self, index):
+        if self.features is None: #reopened lazily in each worker
+            self.features = FeatureStore(self.store_directory).features
+        return torch.from_numpy(self.features[index]) #zero-copy view onto the memory map, the DataLoader collate makes the only copy
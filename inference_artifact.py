@@ -0,0 +1,39 @@
+import json
+import torch
+
+#> Lightweight loader for artifacts written by model_export.export_model.
+#> Only needs torch: models.py, librosa, scipy and the training code are never imported.
+
+class InferenceArtifact:
+    def __init__(self, artifact_path, device="cpu"):
+        extra_files = {'metadata.json': ''}
+        self.device = torch.device(device)
+        self.model = torch.jit.load(artifact_path, map_location=self.device, _extra_files=extra_files)
+        self.model.eval()
+
+        self.metadata = json.loads(extra_files['metadata.json'])
+        self.anomaly_threshold = self.metadata.get('anomaly_threshold')
+        self.acoustic_features = self.metadata.get('acoustic_features', {})
+        self.input_features = self.metadata['input_features']
+
+
+    #> Mean squared reconstruction error of every 640-dim frame
+    def frame_errors(self, frames):
+        with torch.inference_mode():
+            input = torch.as_tensor(frames, dtype=torch.float32).to(self.device)
+            output = self.model(input)
+            return ((output - input)**2).mean(dim=1).cpu().numpy()
+
+
+    #> Anomaly score of one clip, the same value as Evaluator.mse on its frames
+    def score_clip(self, frames):
+        return float(self.frame_errors(frames).mean())
+
+
+    def predict(self, score):
+        return int(score > self.anomaly_threshold)
+
+
+
+def load_artifact(artifact_path, device="cpu"):
+    return InferenceArtifact(artifact_path, device=device)
\ No newline at end of file
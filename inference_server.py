@@ -0,0 +1,247 @@
+import json
+import time
+import struct
+import asyncio
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_artifact import load_artifact
+
+#> Wire format (little endian) over a local TCP socket:
+#>   request   uint32 request_id, uint32 number_of_frames, number_of_frames * input_features float32
+#>   response  uint32 request_id, float32 clip_score
+#>   number_of_frames = METRICS_REQUEST asks for the metrics instead, answered with uint32 request_id, uint32 length, JSON
+HEADER = struct.Struct('<II')
+SCORE = struct.Struct('<If')
+METRICS_REQUEST = 0xFFFFFFFF
+
+
+#> Queues clip scoring requests from many clients and coalesces them into one forward pass per batch
+class InferenceServer:
+    def __init__(self, artifact_path, host="127.0.0.1", port=8765, max_batch_frames=8192, max_latency_ms=5.0, device="cpu"):
+        self.artifact = load_artifact(artifact_path, device=device)
+        self.input_features = self.artifact.input_features
+
+        self.host = host
+        self.port = port
+        self.max_batch_frames = max_batch_frames #a batch is run as soon as it holds this many frames ...
+        self.max_latency = max_latency_ms / 1000 #... or when its oldest request has waited this long
+
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1) #one forward pass at a time, torch uses the cores inside it
+
+        #> metrics
+        self.latencies = deque(maxlen=10000)
+        self.batch_frames = deque(maxlen=1000)
+        self.batch_requests = deque(maxlen=1000)
+        self.number_of_requests = 0
+
+
+    async def start(self):
+        self.batcher = asyncio.create_task(self.run_batches())
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        return self.server
+
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown(wait=False)
+
+        #> requests that never made it into a batch would otherwise wait forever
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(ConnectionError("Inference server closed"))
+
+
+    #> Scores one clip (frames, input_features), usable in-process without going through the socket
+    async def score(self, frames):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((np.ascontiguousarray(frames, dtype=np.float32), future, time.perf_counter()))
+        return await future
+
+
+    async def handle_client(self, reader, writer):
+        pending = set()
+
+        try:
+            while True:
+                request_id, number_of_frames = HEADER.unpack(await reader.readexactly(HEADER.size))
+
+                if number_of_frames == METRICS_REQUEST:
+                    metrics = json.dumps(self.metrics()).encode()
+                    writer.write(HEADER.pack(request_id, len(metrics)) + metrics)
+                    await writer.drain()
+                    continue
+
+                payload = await reader.readexactly(number_of_frames * self.input_features * 4)
+                frames = np.frombuffer(payload, dtype=np.float32).reshape(number_of_frames, self.input_features)
+
+                #> answer out of order as soon as the batch with this request is done, the client matches request ids
+                task = asyncio.create_task(self.respond(writer, request_id, frames))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            writer.close()
+
+
+    async def respond(self, writer, request_id, frames):
+        score = await self.score(frames)
+        writer.write(SCORE.pack(request_id, score))
+        await writer.drain()
+
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            number_of_frames = len(batch[0][0])
+            deadline = batch[0][2] + self.max_latency
+
+            #> keep collecting until the batch is full or the oldest request reaches its latency budget
+            while number_of_frames < self.max_batch_frames:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                number_of_frames += len(request[0])
+
+            try:
+                scores = await loop.run_in_executor(self.executor, self.score_batch, [frames for frames, _, _ in batch])
+            except asyncio.CancelledError: #close() while this batch was running
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(ConnectionError("Inference server closed"))
+                raise
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, enqueued), score in zip(batch, scores):
+                if not future.done():
+                    future.set_result(float(score))
+                self.latencies.append(finished - enqueued)
+
+            self.batch_frames.append(number_of_frames)
+            self.batch_requests.append(len(batch))
+            self.number_of_requests += len(batch)
+
+
+    #> One forward pass for all requests, then the per-frame errors are scattered back per clip
+    def score_batch(self, frame_lists):
+        clip_lengths = np.array([len(frames) for frames in frame_lists])
+        frame_errors = self.artifact.frame_errors(np.concatenate(frame_lists))
+
+        offsets = np.concatenate(([0], np.cumsum(clip_lengths)[:-1]))
+        scores = np.zeros(len(frame_lists))
+        non_empty = clip_lengths > 0
+        if np.any(non_empty):
+            scores[non_empty] = np.add.reduceat(frame_errors, offsets[non_empty]) / clip_lengths[non_empty]
+
+        return scores
+
+
+    def metrics(self):
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+
+        return {
+            'queue_depth': self.queue.qsize(),
+            'requests': self.number_of_requests,
+            'mean_batch_frames': float(np.mean(self.batch_frames)) if self.batch_frames else 0.0,
+            'mean_batch_requests': float(np.mean(self.batch_requests)) if self.batch_requests else 0.0,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+        }
+
+
+
+#> Client side of the protocol, several score() calls can be in flight on one connection
+class InferenceClient:
+    def __init__(self, host="127.0.0.1", port=8765):
+        self.host = host
+        self.port = port
+        self.next_request_id = 0
+        self.pending = {}
+
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.receiver = asyncio.create_task(self.receive())
+        return self
+
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+        self.fail_pending(ConnectionError("Inference client closed"))
+
+
+    def fail_pending(self, exception):
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(exception)
+        self.pending.clear()
+
+
+    def new_request(self, metrics=False):
+        if self.receiver.done():
+            raise ConnectionError("Connection to the inference server is closed")
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) % METRICS_REQUEST
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, metrics)
+        return request_id, future
+
+
+    async def score(self, frames):
+        frames = np.ascontiguousarray(frames, dtype=np.float32)
+        request_id, future = self.new_request()
+
+        self.writer.write(HEADER.pack(request_id, len(frames)) + frames.tobytes())
+        await self.writer.drain()
+        return await future
+
+
+    async def metrics(self):
+        request_id, future = self.new_request(metrics=True)
+
+        self.writer.write(HEADER.pack(request_id, METRICS_REQUEST))
+        await self.writer.drain()
+        return await future
+
+
+    async def receive(self):
+        try:
+            while True:
+                request_id = struct.unpack('<I', await self.reader.readexactly(4))[0]
+                future, metrics = self.pending.pop(request_id)
+
+                if metrics:
+                    length = struct.unpack('<I', await self.reader.readexactly(4))[0]
+                    future.set_result(json.loads(await self.reader.readexactly(length)))
+                else:
+                    future.set_result(struct.unpack('<f', await self.reader.readexactly(4))[0])
+        except (asyncio.IncompleteReadError, ConnectionError) as e: #the server went away, fail every request still in flight
+            self.fail_pending(ConnectionError(f"Connection to the inference server closed ({e})"))
\ No newline at end of file
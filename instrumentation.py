@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from collections import defaultdict
+
+#> Opt-in spans and counters around the hot paths of the pipeline.
+#> Enable with instrumentation.enable() or PIPELINE_TRACE=1; while disabled a span is a shared no-op context manager.
+#>   with instrumentation.span("audio.decode"): ...
+#>   instrumentation.export_chrome_trace("trace.json")   #open in chrome://tracing or ui.perfetto.dev
+#>   print(instrumentation.summary())
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+
+class Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.record_function = None
+
+    def __enter__(self):
+        if self.tracer.torch_profiler is not None: #show the span inside the torch.profiler trace as well
+            from torch.autograd.profiler import record_function
+            self.record_function = record_function(self.name)
+            self.record_function.__enter__()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.tracer.synchronize_cuda:
+            self.tracer.cuda_synchronize() #otherwise a span only measures the kernel launches
+        end = time.perf_counter_ns()
+        if self.record_function is not None:
+            self.record_function.__exit__(exc_type, exc_value, traceback)
+        self.tracer.record(self.name, self.start, end, self.args)
+        return False
+
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = os.environ.get("PIPELINE_TRACE", "0") not in ("", "0")
+        self.synchronize_cuda = False
+        self.torch_profiler = None
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.events = []
+            self.counters = defaultdict(float)
+            self.origin = time.perf_counter_ns()
+
+
+    def record(self, name, start, end, args=None):
+        event = {
+            'name': name,
+            'ph': 'X', #complete event
+            'ts': (start - self.origin) / 1000, #microseconds
+            'dur': (end - start) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+            self.events.append({'name': name, 'ph': 'C', 'ts': (time.perf_counter_ns() - self.origin) / 1000, 'pid': os.getpid(), 'args': {name: self.counters[name]}})
+
+
+    def cuda_synchronize(self):
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+
+tracer = Tracer()
+
+
+def enable(synchronize_cuda=False):
+    tracer.enabled = True
+    tracer.synchronize_cuda = synchronize_cuda
+
+
+def disable():
+    tracer.enabled = False
+
+
+def reset():
+    tracer.reset()
+
+
+def span(name, **args):
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def count(name, value=1):
+    if tracer.enabled:
+        tracer.count(name, value)
+
+
+#> Decorator version of span, the enabled flag is checked on every call
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with Span(tracer, name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+#> Writes the Chrome trace / Perfetto JSON of everything recorded since the last reset
+def export_chrome_trace(path):
+    with tracer.lock:
+        trace = {'traceEvents': list(tracer.events), 'displayTimeUnit': 'ms'}
+    with open(path, 'w') as file:
+        json.dump(trace, file)
+    return path
+
+
+#> Per-stage table: calls, total / mean / max time and share of the traced time
+def summary():
+    with tracer.lock:
+        stages = defaultdict(list)
+        for event in tracer.events:
+            if event['ph'] == 'X':
+                stages[event['name']].append(event['dur'] / 1000) #milliseconds
+        counters = dict(tracer.counters)
+
+    total_time = sum(sum(durations) for durations in stages.values()) or 1.0 #nested spans are counted in both stages
+
+    lines = [f"{'stage':<36} {'calls':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10} {'share':>7}"]
+    for name, durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        lines.append(f"{name:<36} {len(durations):>8} {sum(durations):>12.2f} {sum(durations) / len(durations):>10.3f} {max(durations):>10.3f} {100 * sum(durations) / total_time:>6.1f}%")
+    for name, value in sorted(counters.items()):
+        lines.append(f"{name:<36} {value:>8g}")
+
+    return "\n".join(lines)
+
+
+
+#> Runs torch.profiler alongside the spans (each span becomes a record_function range) and exports its trace too
+class TorchProfile:
+    def __init__(self, trace_path="torch_trace.json", **profiler_arguments):
+        self.trace_path = trace_path
+        self.profiler_arguments = profiler_arguments
+
+    def __enter__(self):
+        from torch.profiler import profile, ProfilerActivity
+        import torch
+
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        self.profiler = profile(activities=activities, **self.profiler_arguments)
+        self.profiler.__enter__()
+        tracer.torch_profiler = self.profiler
+        return self.profiler
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        tracer.torch_profiler = None
+        self.profiler.__exit__(exc_type, exc_value, traceback)
+        self.profiler.export_chrome_trace(self.trace_path)
+        return False
\ No newline at end of file
@@ -0,0 +1,222 @@
+import os
+import re
+import wave
+import random
+import sqlite3
+
+#> e.g. section_00_source_train_normal_0000_car_A1_spd_28V_mic_1.wav
+FILENAME_PATTERN = re.compile(r"section_(?P<section>\d+)_(?P<domain>source|target)_(?P<split>train|test)_(?P<label>normal|anomaly)_(?P<index>\d+)(?:_(?P<attributes>.*))?\.wav$")
+
+COLUMNS = ['path', 'directory', 'dataset_type', 'machine_type', 'split', 'section', 'domain', 'label', 'attributes', 'duration', 'sample_rate', 'mtime_ns', 'size']
+
+#> Parses the labels that DCASE encodes in the filename, missing fields are None (e.g. unlabelled evaluation data)
+def parse_filename(filename):
+    metadata = {'section': None, 'domain': None, 'split': None, 'label': None, 'attributes': None}
+
+    match = FILENAME_PATTERN.search(os.path.basename(filename))
+    if match:
+        metadata.update({key: value for key, value in match.groupdict().items() if key != 'index'})
+
+    return metadata
+
+
+#> Parses the DCASE directory layout, e.g. Development/bearing/train -> dataset type Development, machine type bearing.
+#> The one place a machine type is derived from a path: the manifest and ZipIngester both use it.
+def parse_directory(relative_directory):
+    parts = relative_directory.replace('\\', '/').strip('/').split('/')
+
+    return {
+        'dataset_type': parts[0] if len(parts) > 1 else None,
+        'machine_type': parts[-2] if len(parts) > 1 else None,
+        'split_directory': parts[-1] or None, #train, test, supplemental, ...
+    }
+
+
+#> Reads duration and sample rate from the WAV header only
+def read_wav_info(wav_path):
+    try:
+        with wave.open(wav_path, 'rb') as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate(), wav_file.getframerate()
+    except (wave.Error, EOFError):
+        import soundfile as sf #float / extensible WAVs that the wave module does not understand
+        info = sf.info(wav_path)
+        return info.duration, info.samplerate
+
+
+
+#> SQLite index of every WAV file under root_path, refreshed incrementally by directory and file mtime
+class DatasetManifest:
+    def __init__(self, root_path="datasets/DCASE2025T2", manifest_path=None):
+        self.root_path = root_path
+        self.manifest_path = manifest_path if manifest_path is not None else os.path.normpath(root_path) + ".manifest.sqlite" #next to the tree, e.g. datasets/DCASE2025T2.manifest.sqlite
+
+        self.connection = sqlite3.connect(self.manifest_path)
+        self.connection.row_factory = sqlite3.Row
+        self.create_tables()
+
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, directory TEXT, dataset_type TEXT, machine_type TEXT, split TEXT,
+                    section TEXT, domain TEXT, label TEXT, attributes TEXT,
+                    duration REAL, sample_rate INTEGER, mtime_ns INTEGER, size INTEGER
+                )""")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_selection ON files (machine_type, split, label)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_directory ON files (directory)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent)")
+
+
+    def close(self):
+        self.connection.close()
+
+
+    #> Brings the manifest up to date, only directories whose mtime changed are listed again.
+    #> check_files also stats the files of unchanged directories, to pick up WAVs rewritten in place.
+    def refresh(self, check_files=False):
+        with self.connection:
+            seen_directories = set()
+            self.refresh_directory(self.root_path, None, seen_directories, check_files)
+
+            #> forget directories (and their files) that no longer exist
+            for row in self.connection.execute("SELECT path FROM directories").fetchall():
+                if row['path'] not in seen_directories:
+                    self.connection.execute("DELETE FROM directories WHERE path = ?", (row['path'],))
+                    self.connection.execute("DELETE FROM files WHERE directory = ?", (self.normalise(row['path']),))
+
+
+    def refresh_directory(self, directory_path, parent, seen_directories, check_files=False):
+        try:
+            mtime_ns = os.stat(directory_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        seen_directories.add(directory_path)
+
+        row = self.connection.execute("SELECT mtime_ns FROM directories WHERE path = ?", (directory_path,)).fetchone()
+
+        if row is not None and row['mtime_ns'] == mtime_ns: #no entries were added or removed, reuse the stored subdirectories
+            subdirectories = [child['path'] for child in self.connection.execute("SELECT path FROM directories WHERE parent = ?", (directory_path,))]
+            if check_files:
+                self.refresh_files(directory_path)
+        else:
+            subdirectories = []
+            wav_entries = []
+            with os.scandir(directory_path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirectories.append(entry.path)
+                    elif entry.name.lower().endswith('.wav'):
+                        wav_entries.append(entry)
+
+            self.update_files(directory_path, wav_entries)
+            self.connection.execute("INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)", (directory_path, parent, mtime_ns))
+
+        for subdirectory in subdirectories:
+            self.refresh_directory(subdirectory, directory_path, seen_directories, check_files)
+
+
+    #> Files can be rewritten in place without touching the directory mtime, check the known ones by stat only
+    def refresh_files(self, directory_path):
+        rows = self.connection.execute("SELECT path, mtime_ns, size FROM files WHERE directory = ?", (self.normalise(directory_path),)).fetchall()
+        for row in rows:
+            try:
+                stat = os.stat(row['path'])
+            except FileNotFoundError:
+                self.connection.execute("DELETE FROM files WHERE path = ?", (row['path'],))
+                continue
+            if stat.st_mtime_ns != row['mtime_ns'] or stat.st_size != row['size']:
+                self.insert_file(row['path'], stat)
+
+
+    def update_files(self, directory_path, wav_entries):
+        known = {row['path']: (row['mtime_ns'], row['size']) for row in self.connection.execute("SELECT path, mtime_ns, size FROM files WHERE directory = ?", (self.normalise(directory_path),))}
+        present = set()
+
+        for entry in wav_entries:
+            present.add(entry.path)
+            stat = entry.stat()
+            if known.get(entry.path) != (stat.st_mtime_ns, stat.st_size):
+                self.insert_file(entry.path, stat)
+
+        for path in known.keys() - present:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+
+    def insert_file(self, file_path, stat):
+        directory = os.path.dirname(file_path)
+        directory_metadata = parse_directory(os.path.relpath(directory, self.root_path)) #e.g. Development/bearing/train
+
+        metadata = parse_filename(file_path)
+        duration, sample_rate = read_wav_info(file_path)
+
+        self.connection.execute(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", (
+            file_path,
+            self.normalise(directory),
+            directory_metadata['dataset_type'],
+            directory_metadata['machine_type'],
+            metadata['split'] or directory_metadata['split_directory'], #e.g. supplemental
+            metadata['section'],
+            metadata['domain'],
+            metadata['label'],
+            metadata['attributes'],
+            duration,
+            sample_rate,
+            stat.st_mtime_ns,
+            stat.st_size,
+        ))
+
+
+    #> Paths are matched with forward slashes, so 'bearing\test' and 'bearing/test' select the same files on every OS
+    def normalise(self, path):
+        return path.replace('\\', '/')
+
+
+    #> Structured selection, every argument is a value or a list of values; inclusion_string keeps the old substring semantics
+    def select(self, machine_types=None, splits=None, labels=None, domains=None, sections=None, dataset_types=None, inclusion_string=None, include_supplemental=False):
+        conditions = []
+        parameters = []
+
+        for column, values in (('machine_type', machine_types), ('split', splits), ('label', labels), ('domain', domains), ('section', sections), ('dataset_type', dataset_types)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            parameters.extend(values)
+
+        if inclusion_string is not None:
+            condition = "instr(directory, ?) > 0"
+            parameters.append(self.normalise(inclusion_string))
+            if include_supplemental: #supplemental data is included regardless of the inclusion string, like DataBundler did
+                condition = f"({condition} OR instr(directory, 'supplemental') > 0)"
+            conditions.append(condition)
+
+        query = f"SELECT * FROM files {'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY path"
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+
+    #> Keeps `percentage` of every (machine type, split, domain, label) group, so small groups are not sampled away
+    def sample(self, rows, percentage=1.0, shuffle=True, stratify_by=('machine_type', 'split', 'domain', 'label'), seed=None):
+        generator = random.Random(seed) if seed is not None else random #without a seed random.seed() still controls the subset, like before the manifest
+
+        if percentage >= 1.0:
+            sampled = list(rows)
+        else:
+            strata = {}
+            for row in rows:
+                strata.setdefault(tuple(row[column] for column in stratify_by), []).append(row)
+
+            sampled = []
+            for stratum in strata.values():
+                if shuffle:
+                    generator.shuffle(stratum)
+                number_to_keep = int(round(percentage * len(stratum)))
+                if percentage > 0:
+                    number_to_keep = max(number_to_keep, 1) #a small stratum (e.g. the few target-domain clips) must not round down to nothing
+                sampled.extend(stratum[:number_to_keep])
+
+        if shuffle:
+            generator.shuffle(sampled)
+
+        return sampled
\ No newline at end of file
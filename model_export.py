@@ -0,0 +1,76 @@
+import os
+import copy
+import json
+import yaml
+import torch
+import torch.nn as nn
+
+import models
+
+#> Folds every BatchNorm1d into the Linear layer before it and returns the whole autoencoder as one nn.Sequential
+def fold_batchnorm(model):
+    model = model.eval()
+    layers = []
+
+    for module in list(model.encoder) + list(model.decoder):
+        if isinstance(module, nn.BatchNorm1d) and layers and isinstance(layers[-1], nn.Linear):
+            linear = layers[-1]
+            scale = module.weight / torch.sqrt(module.running_var + module.eps) #gamma / sqrt(var + eps)
+
+            folded = nn.Linear(linear.in_features, linear.out_features)
+            with torch.no_grad():
+                folded.weight.copy_(linear.weight * scale[:, None])
+                folded.bias.copy_((linear.bias - module.running_mean) * scale + module.bias)
+
+            layers[-1] = folded
+        else:
+            layers.append(module)
+
+    return nn.Sequential(*layers).eval()
+
+
+#> Saves a frozen TorchScript artifact that carries its acoustic parameters and threshold, load it with inference_artifact.load_artifact
+def export_model(model, artifact_path, anomaly_threshold=None, hyper_parameters=None, metadata=None):
+    if hyper_parameters is None:
+        with open("hyper_parameters.yaml", 'r') as file:
+            hyper_parameters = yaml.safe_load(file)
+
+    model = copy.deepcopy(model).cpu().eval() #the caller's model keeps its device and training mode
+    folded_model = fold_batchnorm(model)
+    input_features = folded_model[0].in_features
+
+    with torch.no_grad():
+        scripted_model = torch.jit.trace(folded_model, torch.zeros(2, input_features))
+        scripted_model = torch.jit.freeze(scripted_model) #inlines the weights as constants
+
+        #> the folded model has to give the same output as the original one in eval mode
+        example = torch.randn(8, input_features)
+        difference = (scripted_model(example) - model(example)).abs().max().item()
+
+    artifact_metadata = {
+        'model_class': type(model).__name__,
+        'input_features': input_features,
+        'anomaly_threshold': None if anomaly_threshold is None else float(anomaly_threshold),
+        'acoustic_features': hyper_parameters['acoustic_features'],
+        'folding_error': difference,
+    }
+    artifact_metadata.update(metadata or {})
+
+    os.makedirs(os.path.dirname(artifact_path) or ".", exist_ok=True)
+    torch.jit.save(scripted_model, artifact_path, _extra_files={'metadata.json': json.dumps(artifact_metadata)})
+
+    return artifact_path
+
+
+#> Exports a Trainer / MultiModelTrainer checkpoint from saved_models/
+def export_checkpoint(checkpoint_path, artifact_path=None, anomaly_threshold=None):
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+
+    model = getattr(models, checkpoint['model_class'])()
+    model.load_state_dict(checkpoint['model_state_dict'])
+
+    if artifact_path is None:
+        artifact_path = os.path.splitext(checkpoint_path)[0] + ".pt"
+
+    metadata = {'machine_type': checkpoint['machine_type']} if 'machine_type' in checkpoint else None
+    return export_model(model, artifact_path, anomaly_threshold, checkpoint.get('hyper_parameters'), metadata)
\ No newline at end of file
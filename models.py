@@ -1,3 +1,5 @@
+import copy
+import torch
 import torch.nn as nn
 
 class AF_Autoencoder(nn.Module):
@@ -93,4 +95,93 @@ class BaselineAutoencoder(nn.Module):
 
         #print(f"Input vector: {x}")
 
-        return decoded
\ No newline at end of file
+        return decoded
+
+
+
+#> One Linear layer per model, evaluated for all models at once with a single batched matmul (grouped GEMM)
+class GroupedLinear(nn.Module):
+    def __init__(self, number_of_models, in_features, out_features):
+        super(GroupedLinear, self).__init__()
+        self.weight = nn.Parameter(torch.empty(number_of_models, in_features, out_features))
+        self.bias = nn.Parameter(torch.empty(number_of_models, out_features))
+
+    @classmethod
+    def from_modules(cls, linears):
+        grouped = cls(len(linears), linears[0].in_features, linears[0].out_features)
+        with torch.no_grad():
+            grouped.weight.copy_(torch.stack([linear.weight.t() for linear in linears])) #start from the default nn.Linear initialisation
+            grouped.bias.copy_(torch.stack([linear.bias for linear in linears]))
+        return grouped
+
+    def forward(self, x): #(models, batch, in_features) -> (models, batch, out_features)
+        return torch.baddbmm(self.bias.unsqueeze(1), x, self.weight)
+
+
+
+#> One BatchNorm1d per model, implemented as a single BatchNorm1d over models * features channels
+class GroupedBatchNorm1d(nn.Module):
+    def __init__(self, number_of_models, number_of_features):
+        super(GroupedBatchNorm1d, self).__init__()
+        self.number_of_models = number_of_models
+        self.number_of_features = number_of_features
+        self.batch_norm = nn.BatchNorm1d(number_of_models * number_of_features)
+
+    @classmethod
+    def from_modules(cls, batch_norms):
+        return cls(len(batch_norms), batch_norms[0].num_features)
+
+    def forward(self, x): #(models, batch, features), statistics are computed per model and feature
+        models, batch, features = x.shape
+        x = self.batch_norm(x.transpose(0, 1).reshape(batch, models * features))
+        return x.reshape(batch, models, features).transpose(0, 1)
+
+
+
+#> Trains number_of_models copies of model_class side by side, input and output are (models, batch, 640)
+class GroupedAutoencoder(nn.Module):
+    def __init__(self, model_class, number_of_models):
+        super(GroupedAutoencoder, self).__init__()
+        self.model_class = model_class
+        self.number_of_models = number_of_models
+
+        templates = [model_class() for _ in range(number_of_models)]
+        self.encoder = self.group_sequential([template.encoder for template in templates])
+        self.decoder = self.group_sequential([template.decoder for template in templates])
+
+    def group_sequential(self, sequentials):
+        layers = []
+        for modules in zip(*sequentials):
+            if isinstance(modules[0], nn.Linear):
+                layers.append(GroupedLinear.from_modules(modules))
+            elif isinstance(modules[0], nn.BatchNorm1d):
+                layers.append(GroupedBatchNorm1d.from_modules(modules))
+            else:
+                layers.append(copy.deepcopy(modules[0])) #activations are stateless
+        return nn.Sequential(*layers)
+
+    def forward(self, x):
+        encoded = self.encoder(x)
+        decoded = self.decoder(encoded)
+
+        return decoded
+
+    #> Returns model i as a plain model_class instance, e.g. to save it or to run it without the others
+    def export(self, i):
+        model = self.model_class()
+
+        for grouped_sequential, sequential in ((self.encoder, model.encoder), (self.decoder, model.decoder)):
+            for grouped, module in zip(grouped_sequential, sequential):
+                with torch.no_grad():
+                    if isinstance(grouped, GroupedLinear):
+                        module.weight.copy_(grouped.weight[i].t())
+                        module.bias.copy_(grouped.bias[i])
+                    elif isinstance(grouped, GroupedBatchNorm1d):
+                        channels = slice(i * grouped.number_of_features, (i + 1) * grouped.number_of_features)
+                        module.weight.copy_(grouped.batch_norm.weight[channels])
+                        module.bias.copy_(grouped.batch_norm.bias[channels])
+                        module.running_mean.copy_(grouped.batch_norm.running_mean[channels])
+                        module.running_var.copy_(grouped.batch_norm.running_var[channels])
+                        module.num_batches_tracked.copy_(grouped.batch_norm.num_batches_tracked)
+
+        return model.eval()
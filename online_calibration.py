@@ -0,0 +1,124 @@
+import os
+import json
+import numpy as np
+
+from scipy.special import gammaincinv
+
+from threshold_calibration import ThresholdCalibrator
+
+#> Tracks the gamma threshold of every machine from a stream of normal-operation scores.
+#> Each machine keeps exponentially decayed sums of x, x^2 and log(x), so an update is O(1) and memory does not grow.
+class OnlineThresholdCalibrator:
+    def __init__(self, percentile=0.9, decay=0.999, minimum_count=100, reject_anomalies=False, method="mle", rejection_factor=3.0):
+        self.percentile = percentile
+        self.decay = decay #weight of the past per new score, 0.999 ~ effective window of 1000 scores
+        self.minimum_count = minimum_count #no threshold until this many scores were seen
+        #> optionally drop scores far outside the fitted distribution, rejecting everything above the threshold itself
+        #> would cut off the top of the normal scores too, so every refit would lower the threshold further
+        self.reject_anomalies = reject_anomalies
+        self.rejection_factor = rejection_factor #scores above rejection_factor * threshold do not move it
+        self.method = method
+        self.threshold_calibrator = ThresholdCalibrator(method=method, iterations=3)
+        self.states = {}
+
+
+    def new_state(self):
+        return {'count': 0, 'weight': 0.0, 'sum': 0.0, 'sum_of_squares': 0.0, 'sum_of_logs': 0.0, 'shape': None, 'scale': None, 'threshold': None}
+
+
+    #> Absorbs one score and returns the machine's current threshold (None while warming up)
+    def update(self, machine, score):
+        state = self.states.setdefault(machine, self.new_state())
+        score = float(score)
+
+        if score <= 0 or not np.isfinite(score):
+            return state['threshold']
+        if self.reject_anomalies and state['threshold'] is not None and score > self.rejection_factor * state['threshold']:
+            return state['threshold']
+
+        state['count'] += 1
+        state['weight'] = self.decay * state['weight'] + 1.0
+        state['sum'] = self.decay * state['sum'] + score
+        state['sum_of_squares'] = self.decay * state['sum_of_squares'] + score**2
+        state['sum_of_logs'] = self.decay * state['sum_of_logs'] + np.log(score)
+
+        if state['count'] >= self.minimum_count:
+            self.refit(state)
+
+        return state['threshold']
+
+
+    #> Seeds a machine with a batch of scores, e.g. the offline reconstruction errors of its training clips
+    def update_many(self, machine, scores):
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        scores = scores[np.isfinite(scores) & (scores > 0)]
+        weights = self.decay ** np.arange(len(scores) - 1, -1, -1) #the last score is the most recent
+
+        state = self.states.setdefault(machine, self.new_state())
+        past_weight = self.decay ** len(scores)
+
+        state['count'] += len(scores)
+        state['weight'] = past_weight * state['weight'] + weights.sum()
+        state['sum'] = past_weight * state['sum'] + weights @ scores
+        state['sum_of_squares'] = past_weight * state['sum_of_squares'] + weights @ scores**2
+        state['sum_of_logs'] = past_weight * state['sum_of_logs'] + weights @ np.log(scores)
+
+        if state['count'] >= self.minimum_count:
+            self.refit(state)
+
+        return state['threshold']
+
+
+    def refit(self, state):
+        mean = state['sum'] / state['weight']
+        variance = state['sum_of_squares'] / state['weight'] - mean**2
+        if mean <= 0 or variance <= 0:
+            return
+
+        shape = mean**2 / variance #method of moments
+        if self.method == "mle": #a fixed number of Newton steps, so the cost per update stays constant
+            shape = float(self.threshold_calibrator.fit_shapes_mle(np.array([mean]), np.array([state['sum_of_logs'] / state['weight']]), np.array([shape]))[0])
+
+        if not np.isfinite(shape) or shape <= 0:
+            return
+
+        state['shape'] = shape
+        state['scale'] = mean / shape
+        state['threshold'] = float(gammaincinv(shape, self.percentile) * state['scale']) #gamma.ppf with loc = 0
+
+
+    def threshold(self, machine):
+        state = self.states.get(machine)
+        return None if state is None else state['threshold']
+
+
+    #> Stored next to the model, e.g. saved_models/BaselineAutoencoder_bearing_calibration.json
+    def save_checkpoint(self, model_name, save_directory="saved_models"):
+        os.makedirs(save_directory, exist_ok=True)
+        checkpoint_path = os.path.join(save_directory, f"{model_name}_calibration.json")
+
+        temporary_path = checkpoint_path + ".tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({
+                'percentile': self.percentile,
+                'decay': self.decay,
+                'minimum_count': self.minimum_count,
+                'reject_anomalies': self.reject_anomalies,
+                'rejection_factor': self.rejection_factor,
+                'method': self.method,
+                'states': self.states,
+            }, file, indent=2)
+        os.replace(temporary_path, checkpoint_path)
+
+        return checkpoint_path
+
+
+    @classmethod
+    def load_checkpoint(cls, model_name, save_directory="saved_models"):
+        with open(os.path.join(save_directory, f"{model_name}_calibration.json"), 'r') as file:
+            checkpoint = json.load(file)
+
+        calibrator = cls(checkpoint['percentile'], checkpoint['decay'], checkpoint['minimum_count'], checkpoint['reject_anomalies'], checkpoint['method'], checkpoint.get('rejection_factor', 3.0))
+        calibrator.states = checkpoint['states']
+
+        return calibrator
\ No newline at end of file
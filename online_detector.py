@@ -0,0 +1,162 @@
+import asyncio
+import librosa
+import torch
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_converter import AudioConverter
+from evaluator import Evaluator
+
+#> Scores one live audio stream: PCM chunks -> ring buffer of mel frames -> model input every 5 frames -> rolling score
+class OnlineDetector:
+    def __init__(self, model, anomaly_threshold, device="cpu", sample_rate=16000, score_window=None, reference_frames=None):
+        self.model = model.to(device).eval()
+        self.anomaly_threshold = anomaly_threshold
+        self.device = torch.device(device)
+        self.sample_rate = sample_rate
+
+        #> setup acoustic features, frame/hop are derived from the sample rate like AudioConverter.wav_to_mel
+        self.audio_converter = AudioConverter()
+        self.number_of_mels = self.audio_converter.number_of_mels
+        self.number_of_frames_to_concatenate = self.audio_converter.number_of_frames_to_concatenate
+        self.frame_size_samples = int(self.audio_converter.frame_size_seconds * sample_rate)
+        self.hop_size_samples = self.frame_size_samples // 2
+
+        self.online_parameters = self.audio_converter.hyper_parameters.get('online_parameters', {})
+        self.score_window = score_window if score_window is not None else self.online_parameters.get('score_window', 75)
+        self.reference_frames = reference_frames if reference_frames is not None else self.online_parameters.get('reference_frames', 375)
+
+        self.window = librosa.filters.get_window('hann', self.frame_size_samples, fftbins=True).astype(np.float32)
+        self.mel_filterbank = librosa.filters.mel(sr=sample_rate, n_fft=self.frame_size_samples, n_mels=self.number_of_mels)
+
+        self.reset()
+
+
+    def reset(self):
+        self.pcm_buffer = np.zeros(0, dtype=np.float32) #samples that do not fill a whole hop yet
+
+        #> ring buffer of mel power frames, its maximum is the dB reference (ref=np.max over roughly one clip)
+        self.mel_ring = np.zeros((self.reference_frames, self.number_of_mels), dtype=np.float32)
+        self.ring_index = 0
+        self.ring_count = 0
+
+        self.pending_frames = [] #frames that are not part of a model input yet
+        self.input_errors = deque(maxlen=self.score_window)
+        self.frames_seen = 0
+
+
+    #> Consumes a chunk of mono float PCM and returns one event per model input that became available
+    def process_chunk(self, pcm):
+        self.pcm_buffer = np.concatenate((self.pcm_buffer, np.asarray(pcm, dtype=np.float32)))
+        events = []
+
+        while len(self.pcm_buffer) >= self.frame_size_samples:
+            frame = self.pcm_buffer[:self.frame_size_samples]
+            self.pcm_buffer = self.pcm_buffer[self.hop_size_samples:]
+
+            spectrum = np.abs(np.fft.rfft(frame * self.window))**2
+            mel_power = self.mel_filterbank @ spectrum
+
+            self.mel_ring[self.ring_index] = mel_power
+            self.ring_index = (self.ring_index + 1) % self.reference_frames
+            self.ring_count = min(self.ring_count + 1, self.reference_frames)
+
+            self.pending_frames.append(mel_power)
+            self.frames_seen += 1
+
+            if len(self.pending_frames) == self.number_of_frames_to_concatenate:
+                events.append(self.score_pending_frames())
+                self.pending_frames = []
+
+        return events
+
+
+    def power_to_db(self, mel_power, top_db=80.0, amin=1e-10):
+        reference = max(amin, float(self.mel_ring[:self.ring_count].max()))
+        log_spec = 10.0 * np.log10(np.maximum(amin, mel_power)) - 10.0 * np.log10(reference)
+        return np.maximum(log_spec, -top_db)
+
+
+    def score_pending_frames(self):
+        mel_audio = self.power_to_db(np.stack(self.pending_frames, axis=1)) #(mels, 5)
+        _, input_features = self.audio_converter.mel_to_input(mel_audio) #(1, 640)
+
+        with torch.no_grad():
+            input = torch.from_numpy(input_features.astype(np.float32)).to(self.device)
+            output = self.model(input)
+            error = torch.mean((output - input)**2).item()
+
+        self.input_errors.append(error)
+        score = float(np.mean(self.input_errors)) #rolling clip-level score over the last score_window inputs
+
+        #> until a full clip was seen the dB reference and the score window differ from the ones the threshold was fitted on
+        warming_up = self.ring_count < self.reference_frames or len(self.input_errors) < self.score_window
+
+        return {
+            'time': self.frames_seen * self.hop_size_samples / self.sample_rate,
+            'error': error,
+            'score': score,
+            'warming_up': warming_up,
+            'anomaly': 0 if warming_up else int(score > self.anomaly_threshold),
+        }
+
+
+
+#> Monitors many streams in one process, detector work runs in a bounded thread pool so the event loop stays responsive
+class DetectionService:
+    def __init__(self, model_factory, anomaly_threshold, device="cpu", max_workers=4, max_queue_size=1024):
+        self.model_factory = model_factory #returns a trained model, called once per stream
+        self.anomaly_threshold = anomaly_threshold
+        self.device = device
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.events = asyncio.Queue(maxsize=max_queue_size)
+        self.tasks = {}
+
+
+    #> Fits the gamma threshold on reconstruction errors of normal clips, like the offline pipeline
+    @staticmethod
+    def threshold_from_errors(errors):
+        _, anomaly_threshold = Evaluator().gamma_distribution(errors)
+        return anomaly_threshold
+
+
+    def add_stream(self, stream_id, source, sample_rate=16000):
+        detector = OnlineDetector(self.model_factory(), self.anomaly_threshold, device=self.device, sample_rate=sample_rate)
+        self.tasks[stream_id] = asyncio.create_task(self.monitor(stream_id, source, detector))
+        return self.tasks[stream_id]
+
+
+    async def monitor(self, stream_id, source, detector):
+        loop = asyncio.get_running_loop()
+
+        async for chunk in source:
+            events = await loop.run_in_executor(self.executor, detector.process_chunk, chunk)
+            for event in events:
+                event['stream_id'] = stream_id
+                await self.events.put(event) #applies back-pressure when nobody consumes the events
+
+
+    async def wait(self):
+        await asyncio.gather(*self.tasks.values())
+
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+
+#> Replays a WAV file as a fake live stream, set realtime=True to pace the chunks like a real microphone
+async def wav_stream(wav_path, chunk_size=1600, realtime=False):
+    amplitude, sample_rate = AudioConverter().load_audio(wav_path)
+
+    for start_index in range(0, len(amplitude), chunk_size):
+        yield amplitude[start_index:start_index + chunk_size]
+
+        if realtime:
+            await asyncio.sleep(chunk_size / sample_rate)
+        else:
+            await asyncio.sleep(0) #let the other streams run
\ No newline at end of file
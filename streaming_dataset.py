@@ -0,0 +1,81 @@
+import random
+import torch
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+from audio_converter import AudioConverter
+
+#> Decodes clips lazily and yields shuffled batches of 640-dim frames, use it with DataLoader(dataset, batch_size=None)
+class StreamingFrameDataset(IterableDataset):
+    def __init__(self, audio_files, batch_size=None, shuffle=None, shuffle_buffer_size=None, drop_last=False, seed=0):
+        super(StreamingFrameDataset, self).__init__()
+        self.audio_files = list(audio_files)
+
+        audio_converter = AudioConverter()
+        self.batch_size = batch_size if batch_size is not None else audio_converter.batch_size
+        self.shuffle = shuffle if shuffle is not None else audio_converter.shuffle
+
+        #> setup the bounded shuffle buffer (in frames)
+        self.streaming_parameters = audio_converter.hyper_parameters.get('streaming_parameters', {})
+        self.shuffle_buffer_size = shuffle_buffer_size if shuffle_buffer_size is not None else self.streaming_parameters.get('shuffle_buffer_size', 65536)
+        self.shuffle_buffer_size = max(self.shuffle_buffer_size, self.batch_size)
+
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+
+    #> Call before every epoch so each epoch sees a different file order and frame mix
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+    def __iter__(self):
+        #> split the files between the DataLoader workers
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        number_of_workers = worker_info.num_workers if worker_info is not None else 1
+
+        generator = random.Random(self.seed + self.epoch * 1000003 + worker_id)
+        audio_files = self.audio_files[worker_id::number_of_workers]
+        if self.shuffle:
+            generator.shuffle(audio_files)
+
+        random_state = np.random.default_rng(generator.getrandbits(64))
+        audio_converter = AudioConverter(audio_cache_size_mb=0) #built once per worker, every file is decoded once per epoch so decoded PCM is not cached
+
+        buffer = []
+        buffered_frames = 0
+
+        for file_path in audio_files:
+            _, input_features = audio_converter.wav_to_input(file_path)
+            buffer.append(input_features.astype(np.float32, copy=False))
+            buffered_frames += len(input_features)
+
+            if buffered_frames >= self.shuffle_buffer_size:
+                frames = np.concatenate(buffer)
+                if self.shuffle:
+                    frames = frames[random_state.permutation(len(frames))]
+
+                #> emit full batches, keep half of the buffer back to mix with the next clips
+                keep = self.shuffle_buffer_size // 2 if self.shuffle else 0
+                number_of_batches = (len(frames) - keep) // self.batch_size
+                emitted = number_of_batches * self.batch_size
+
+                for start_index in range(0, emitted, self.batch_size):
+                    yield torch.from_numpy(frames[start_index:start_index + self.batch_size])
+
+                buffer = [frames[emitted:]]
+                buffered_frames = len(frames) - emitted
+
+        #> flush whatever is left in the buffer
+        if buffered_frames > 0:
+            frames = np.concatenate(buffer)
+            if self.shuffle:
+                frames = frames[random_state.permutation(len(frames))]
+
+            for start_index in range(0, len(frames), self.batch_size):
+                batch = frames[start_index:start_index + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    break
+                yield torch.from_numpy(batch)
\ No newline at end of file
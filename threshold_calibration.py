@@ -0,0 +1,103 @@
+import numpy as np
+
+from scipy.stats import gamma
+from scipy.special import digamma, polygamma
+
+from evaluator import Evaluator
+
+#> Fits gamma distributions to the reconstruction errors of many groups (e.g. machine type x section) at once
+class ThresholdCalibrator:
+    def __init__(self, method="mle", percentiles=0.9, iterations=10):
+        self.method = method #"mle" (vectorised, loc = 0), "moments" (loc = 0) or "scipy" (3-parameter gamma.fit per group, like Evaluator)
+        self.percentiles = percentiles
+        self.iterations = iterations
+        self.evaluator = Evaluator()
+
+
+    #> errors_by_group maps a group name to its error list, returns {group: {'shape', 'loc', 'scale', 'threshold'}}
+    def calibrate(self, errors_by_group, percentiles=None):
+        percentiles = self.percentiles if percentiles is None else percentiles
+        groups = list(errors_by_group.keys())
+        error_lists = [np.asarray(errors_by_group[group], dtype=np.float64).reshape(-1) for group in groups]
+
+        shapes, locations, scales = self.fit(error_lists)
+        thresholds = self.thresholds(shapes, locations, scales, percentiles)
+
+        return {group: {'shape': shapes[i], 'loc': locations[i], 'scale': scales[i], 'threshold': thresholds[i]} for i, group in enumerate(groups)}
+
+
+    #> Returns arrays (shape, loc, scale) with one entry per error list
+    def fit(self, error_lists):
+        lengths = np.array([len(errors) for errors in error_lists])
+        values = np.concatenate(error_lists) if len(error_lists) > 0 else np.zeros(0)
+
+        shapes = np.full(len(error_lists), np.nan)
+        locations = np.zeros(len(error_lists))
+        scales = np.full(len(error_lists), np.nan)
+
+        if self.method != "scipy" and len(values) > 0:
+            #> per-group sufficient statistics in one pass, with the same segment reduction as Evaluator.clip_errors
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means = self.evaluator.segment_sum(values, lengths) / lengths
+                variances = self.evaluator.segment_sum(values**2, lengths) / lengths - means**2
+                mean_logs = self.evaluator.segment_sum(np.log(np.where(values > 0, values, np.nan)), lengths) / lengths
+
+            #> method of moments, also the starting point of the MLE
+            with np.errstate(divide='ignore', invalid='ignore'):
+                shapes = means**2 / variances
+
+            if self.method == "mle":
+                shapes = self.fit_shapes_mle(means, mean_logs, shapes)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scales = means / shapes
+
+        #> fall back to scipy for groups where the vectorised fit is not defined (non-positive errors, zero variance, too few errors)
+        invalid = ~(np.isfinite(shapes) & np.isfinite(scales) & (shapes > 0) & (scales > 0))
+        for i in np.flatnonzero(invalid):
+            if lengths[i] >= 2:
+                shapes[i], locations[i], scales[i] = gamma.fit(error_lists[i])
+
+        return shapes, locations, scales
+
+
+    #> Solves log(k) - digamma(k) = log(mean) - mean(log x) with Newton's method for all groups at once
+    def fit_shapes_mle(self, means, mean_logs, initial_shapes):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = np.log(means) - mean_logs
+            shapes = (3 - s + np.sqrt((s - 3)**2 + 24 * s)) / (12 * s) #Minka's closed-form approximation
+            shapes = np.where(np.isfinite(shapes) & (shapes > 0), shapes, initial_shapes)
+
+            for _ in range(self.iterations):
+                step = (np.log(shapes) - digamma(shapes) - s) / (1 / shapes - polygamma(1, shapes))
+                shapes = np.where(np.isfinite(step), np.maximum(shapes - step, shapes / 10), shapes)
+
+        return shapes
+
+
+    #> One threshold per group for a single percentile, or a (groups, percentiles) array for a list of percentiles
+    def thresholds(self, shapes, locations, scales, percentiles=0.9):
+        percentiles = np.asarray(percentiles, dtype=np.float64)
+
+        if percentiles.ndim == 0:
+            return gamma.ppf(percentiles, shapes, loc=locations, scale=scales)
+        return gamma.ppf(percentiles[None, :], shapes[:, None], loc=locations[:, None], scale=scales[:, None])
+
+
+    #> Returns {group: make_predictions(values, threshold)}, with one column per percentile when several were calibrated
+    def predict(self, values_by_group, calibration):
+        predictions = {}
+
+        for group, values in values_by_group.items():
+            values = np.asarray(values)
+            threshold = np.asarray(calibration[group]['threshold'])
+            predictions[group] = self.evaluator.make_predictions(values[:, None] if threshold.ndim else values, threshold)
+
+        return predictions
+
+
+    def calibrate_and_predict(self, errors_by_group, values_by_group=None, percentiles=None):
+        calibration = self.calibrate(errors_by_group, percentiles=percentiles)
+        predictions = self.predict(values_by_group if values_by_group is not None else errors_by_group, calibration)
+
+        return calibration, predictions
\ No newline at end of file
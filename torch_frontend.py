@@ -0,0 +1,147 @@
+import torch
+import librosa
+import numpy as np
+
+from audio_converter import AudioConverter
+
+#> Largest absolute difference (in dB) to the librosa front end of AudioConverter that we accept.
+#> Both run the STFT in float32, so the outputs normally agree to ~1e-4 dB; the remaining differences
+#> come from FFT rounding and only show up close to the 80 dB floor of power_to_db.
+TOLERANCE_DB = 1e-2
+
+#> Vectorised STFT -> mel filterbank -> dB -> top frequencies for batches of equal-length clips, on CPU or CUDA
+class TorchMelFrontend:
+    def __init__(self, device=None, max_batch_size=64, top_db=80.0, amin=1e-10):
+        self.audio_converter = AudioConverter(audio_cache_size_mb=0) #wavs_to_input decodes every file once
+        self.number_of_mels = self.audio_converter.number_of_mels
+        self.number_of_frames_to_concatenate = self.audio_converter.number_of_frames_to_concatenate
+        self.frame_size_seconds = self.audio_converter.frame_size_seconds
+        self.frame_size_samples = self.audio_converter.frame_size_samples
+        self.hop_size_samples = self.audio_converter.hop_size_samples
+
+        if device is None:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = torch.device(device)
+
+        self.max_batch_size = max_batch_size
+        self.top_db = top_db
+        self.amin = amin
+
+        self.mel_filterbanks = {} #one librosa filterbank per sample rate, built on first use
+        self.windows = {}
+
+
+    def mel_filterbank(self, sample_rate, n_fft):
+        key = (sample_rate, n_fft)
+        if key not in self.mel_filterbanks:
+            filterbank = librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=self.number_of_mels)
+            self.mel_filterbanks[key] = torch.from_numpy(filterbank).to(self.device)
+        return self.mel_filterbanks[key]
+
+
+    def window(self, n_fft):
+        if n_fft not in self.windows:
+            self.windows[n_fft] = torch.hann_window(n_fft, periodic=True, device=self.device) #same as scipy's 'hann' with fftbins=True
+        return self.windows[n_fft]
+
+
+    #> Magnitude spectrogram (batch, n_fft // 2 + 1, frames), padded like librosa.stft (center=True, pad_mode='constant')
+    def stft_magnitudes(self, waveforms, n_fft, hop_length):
+        spectrum = torch.stft(
+            waveforms,
+            n_fft           = n_fft,
+            hop_length      = hop_length,
+            window          = self.window(n_fft),
+            center          = True,
+            pad_mode        = 'constant',
+            return_complex  = True
+        )
+        return spectrum.abs()
+
+
+    #> Equivalent of librosa.power_to_db(mel, ref=np.max) with the reference taken per clip
+    def power_to_db(self, mel_power):
+        log_spec = 10.0 * torch.log10(torch.clamp(mel_power, min=self.amin))
+        log_spec = log_spec - log_spec.amax(dim=(1, 2), keepdim=True)
+        return torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - self.top_db)
+
+
+    #> Returns (mel_audio, top_frequencies) for a (batch, samples) tensor of equal-length clips
+    def waveforms_to_mel(self, waveforms, sample_rate, n=None):
+        waveforms = waveforms.to(self.device, dtype=torch.float32)
+
+        #> setup audio clip specific acoustic features, as in AudioConverter.amplitude_to_mel
+        frame_size_samples = int(self.frame_size_seconds * sample_rate)
+        hop_size_samples = frame_size_samples // 2
+
+        magnitudes = self.stft_magnitudes(waveforms, frame_size_samples, hop_size_samples)
+        mel_power = torch.matmul(self.mel_filterbank(sample_rate, frame_size_samples), magnitudes.pow(2)) #(mels, bins) @ (batch, bins, frames)
+        mel_audio = self.power_to_db(mel_power)
+
+        top_frequencies = None
+        if n is not None:
+            #> AudioConverter.get_top_frequencies uses the fixed frame/hop sizes, only recompute the STFT when they differ
+            if frame_size_samples != self.frame_size_samples or hop_size_samples != self.hop_size_samples:
+                magnitudes = self.stft_magnitudes(waveforms, self.frame_size_samples, self.hop_size_samples)
+            top_frequencies = self.top_frequencies(magnitudes, sample_rate, n)
+
+        return mel_audio, top_frequencies
+
+
+    def top_frequencies(self, magnitudes, sample_rate, n=10):
+        frequencies = torch.from_numpy(librosa.fft_frequencies(sr=sample_rate, n_fft=self.frame_size_samples)).to(magnitudes.device)
+        mean_magnitudes = magnitudes.mean(dim=2)
+        top_indices = torch.topk(mean_magnitudes, n, dim=1).indices #sorted in descending order, like argsort()[-n:][::-1]
+        return frequencies[top_indices]
+
+
+    #> Batched AudioConverter.mel_to_input, (batch, mels, frames) -> (batch, frames // 5, mels * 5)
+    def mel_to_input(self, mel_audio):
+        trimmed_frames = mel_audio.shape[2] - (mel_audio.shape[2] % self.number_of_frames_to_concatenate)
+        trimmed_audio = mel_audio[:, :, :trimmed_frames]
+
+        concatenated_audio = trimmed_audio.reshape(mel_audio.shape[0], mel_audio.shape[1], trimmed_frames // self.number_of_frames_to_concatenate, self.number_of_frames_to_concatenate)
+        concatenated_audio = concatenated_audio.permute(0, 2, 1, 3)
+        return concatenated_audio.reshape(mel_audio.shape[0], trimmed_frames // self.number_of_frames_to_concatenate, -1)
+
+
+    #> Batched wav_to_input / wav_to_input_with_freq, returns a list of (clip_length, features) in the order of wav_paths
+    def wavs_to_input(self, wav_paths, n=None):
+        results = [None] * len(wav_paths)
+
+        #> decode every file once and group clips that can share one batched pass
+        groups = {}
+        for i, wav_path in enumerate(wav_paths):
+            amplitude, sample_rate = self.audio_converter.load_audio(wav_path)
+            groups.setdefault((len(amplitude), sample_rate), []).append((i, amplitude))
+
+        for (_, sample_rate), clips in groups.items():
+            for start_index in range(0, len(clips), self.max_batch_size):
+                batch = clips[start_index:start_index + self.max_batch_size]
+                waveforms = torch.from_numpy(np.stack([amplitude for _, amplitude in batch]))
+
+                with torch.no_grad():
+                    mel_audio, top_frequencies = self.waveforms_to_mel(waveforms, sample_rate, n=n)
+                    input_features = self.mel_to_input(mel_audio)
+
+                    if top_frequencies is not None:
+                        new_columns = top_frequencies.to(input_features.dtype).unsqueeze(1).expand(-1, input_features.shape[1], -1)
+                        input_features = torch.cat((input_features, new_columns), dim=2)
+
+                input_features = input_features.cpu().numpy()
+                for (i, _), features in zip(batch, input_features):
+                    results[i] = (features.shape[0], features)
+
+        return results
+
+
+    #> Largest absolute difference between this front end and AudioConverter.wav_to_mel for one file
+    def compare_with_librosa(self, wav_path):
+        _, reference = self.audio_converter.wav_to_mel(wav_path)
+        amplitude, sample_rate = self.audio_converter.load_audio(wav_path)
+
+        with torch.no_grad():
+            mel_audio, _ = self.waveforms_to_mel(torch.tensor(amplitude).unsqueeze(0), sample_rate) #copy, cached PCM is read-only
+
+        difference = float(np.max(np.abs(mel_audio[0].cpu().numpy() - reference)))
+        return difference, difference <= TOLERANCE_DB
\ No newline at end of file
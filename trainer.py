@@ -0,0 +1,279 @@
+import os
+import time
+import yaml
+import torch
+import numpy as np
+import torch.nn as nn
+import instrumentation
+from models import GroupedAutoencoder
+from torch.utils.data import DataLoader, Dataset, IterableDataset
+
+class Trainer:
+    def __init__(self, model, device=None, save_directory="saved_models", **overrides):
+        self.hyper_parameters = self.load_hyper_parameters()
+
+        #> setup training parameters, keyword arguments override hyper_parameters.yaml
+        self.training_parameters = dict(self.hyper_parameters['training_parameters'])
+        self.training_parameters.update(overrides)
+        self.batch_size = self.training_parameters['batch_size']
+        self.epochs = self.training_parameters['epochs']
+        self.learning_rate = self.training_parameters['learning_rate']
+        self.shuffle = self.training_parameters['shuffle']
+        self.use_amp = self.training_parameters.get('use_amp', False)
+        self.use_compile = self.training_parameters.get('compile', False)
+        self.pin_memory = self.training_parameters.get('pin_memory', True)
+        self.number_of_workers = self.training_parameters.get('number_of_workers', 0)
+        self.checkpoint_every = self.training_parameters.get('checkpoint_every', 0)
+
+        if device is None:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = torch.device(device)
+        self.pin_memory = self.pin_memory and self.device.type == "cuda"
+
+        self.model = model.to(self.device)
+        self.criterion = nn.MSELoss()
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.learning_rate)
+
+        #> mixed precision, bf16 where the GPU supports it and fp16 with loss scaling otherwise (CPU stays in fp32)
+        self.amp_enabled = self.use_amp and self.device.type == "cuda"
+        self.amp_dtype = torch.bfloat16 if self.amp_enabled and torch.cuda.is_bf16_supported() else torch.float16
+        self.scaler = torch.amp.GradScaler("cuda", enabled=self.amp_enabled and self.amp_dtype == torch.float16)
+
+        self.forward_model = torch.compile(self.model) if self.use_compile and hasattr(torch, 'compile') else self.model
+
+        self.save_directory = save_directory
+        os.makedirs(self.save_directory, exist_ok=True)
+
+        self.training_losses = []
+        self.history = []
+
+
+    def load_hyper_parameters(self):
+        with open("hyper_parameters.yaml", 'r') as file:
+            return yaml.safe_load(file)
+
+
+    #> Accepts a numpy array / memmap, a tensor, a Dataset, an IterableDataset (yielding batches) or a ready DataLoader
+    def make_batches(self, training_data):
+        if isinstance(training_data, DataLoader):
+            return training_data
+        if isinstance(training_data, IterableDataset):
+            return DataLoader(training_data, batch_size=None, num_workers=self.number_of_workers, pin_memory=self.pin_memory)
+        if isinstance(training_data, Dataset):
+            return DataLoader(training_data, batch_size=self.batch_size, shuffle=self.shuffle, num_workers=self.number_of_workers, pin_memory=self.pin_memory)
+
+        return ArrayBatches(training_data, self.batch_size, self.shuffle, self.pin_memory)
+
+
+    #> Copies the next batch to the device while the current one is being trained on
+    def prefetch(self, batches):
+        iterator = iter(batches)
+        next_batch = self.to_device(next(iterator, None))
+
+        while next_batch is not None:
+            batch = next_batch
+            next_batch = self.to_device(next(iterator, None))
+            yield batch
+
+
+    def to_device(self, batch):
+        if batch is None:
+            return None
+        if isinstance(batch, (list, tuple)): #e.g. TensorDataset
+            batch = batch[0]
+        with instrumentation.span("train.host_to_device"):
+            return batch.to(self.device, dtype=torch.float32, non_blocking=True)
+
+
+    def train(self, training_data, model_name=None):
+        batches = self.make_batches(training_data)
+        model_name = model_name or type(self.model).__name__
+        start_time = time.time()
+
+        #> e.g. StreamingFrameDataset, which seeds its shuffle from the epoch (also when wrapped in a DataLoader)
+        dataset = getattr(batches, 'dataset', training_data)
+
+        for epoch in range(self.epochs):
+            if hasattr(dataset, 'set_epoch'):
+                dataset.set_epoch(epoch)
+
+            average_loss, epoch_time, number_of_frames, number_of_steps = self.train_epoch(batches)
+
+            self.training_losses.append(average_loss)
+            self.history.append({
+                'epoch': epoch + 1,
+                'loss': average_loss,
+                'seconds': epoch_time,
+                'frames_per_second': number_of_frames / epoch_time if epoch_time > 0 else 0.0,
+                'step_time_ms': 1000 * epoch_time / max(number_of_steps, 1),
+            })
+
+            elapsed_time = time.time() - start_time
+            print(f"Epoch [{epoch + 1}/{self.epochs}] ({elapsed_time:.2f}s) | Loss: {average_loss:.4f} | {self.history[-1]['frames_per_second']:.0f} frames/s | {self.history[-1]['step_time_ms']:.2f} ms/step")
+
+            if self.checkpoint_every and (epoch + 1) % self.checkpoint_every == 0:
+                self.save_checkpoint(f"{model_name}_epoch_{epoch + 1}", epoch + 1)
+
+        self.model.eval()
+        self.save_checkpoint(model_name, self.epochs)
+
+        return self.training_losses
+
+
+    def train_epoch(self, batches):
+        self.model.train()
+        total_loss = torch.zeros((), device=self.device) #accumulated on the device, synced once per epoch
+        number_of_frames = 0
+        number_of_steps = 0
+
+        epoch_start = time.perf_counter()
+
+        for input in self.prefetch(batches):
+            self.optimizer.zero_grad(set_to_none=True)
+
+            with instrumentation.span("train.forward"):
+                with torch.autocast(device_type=self.device.type, dtype=self.amp_dtype, enabled=self.amp_enabled):
+                    output = self.forward_model(input)
+                loss = self.criterion(output.float(), input)
+
+            with instrumentation.span("train.backward"):
+                self.scaler.scale(loss).backward()
+
+            with instrumentation.span("train.optimizer_step"):
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+
+            total_loss += loss.detach()
+            number_of_frames += input.numel() // input.shape[-1] #frames of every model for grouped (models, batch, 640) input
+            number_of_steps += 1
+
+        average_loss = (total_loss / max(number_of_steps, 1)).item() #the only host sync of the epoch
+        epoch_time = time.perf_counter() - epoch_start
+
+        return average_loss, epoch_time, number_of_frames, number_of_steps
+
+
+    def save_checkpoint(self, name, epoch):
+        checkpoint_path = os.path.join(self.save_directory, f"{name}.pth")
+        torch.save({
+            'model_class': type(self.model).__name__,
+            'model_state_dict': self.model.state_dict(),
+            'optimizer_state_dict': self.optimizer.state_dict(),
+            'epoch': epoch,
+            'training_losses': self.training_losses,
+            'history': self.history,
+            'hyper_parameters': self.hyper_parameters,
+        }, checkpoint_path)
+
+        return checkpoint_path
+
+
+
+#> Batches rows of an in-memory array with one gather per batch instead of collating row by row
+class ArrayBatches:
+    def __init__(self, data, batch_size, shuffle=True, pin_memory=False):
+        self.data = data if isinstance(data, torch.Tensor) else torch.from_numpy(np.asarray(data, dtype=np.float32)) #no copy for float32 arrays
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory
+
+
+    def __len__(self):
+        return (len(self.data) + self.batch_size - 1) // self.batch_size
+
+
+    def __iter__(self):
+        indices = torch.randperm(len(self.data)) if self.shuffle else None
+
+        for start_index in range(0, len(self.data), self.batch_size):
+            if indices is None:
+                batch = self.data[start_index:start_index + self.batch_size]
+            else:
+                batch = self.data[indices[start_index:start_index + self.batch_size]]
+
+            yield batch.pin_memory() if self.pin_memory else batch
+
+
+
+#> Trains one model per machine type in a single pass over the data, every step runs all models as one GroupedAutoencoder
+class MultiModelTrainer(Trainer):
+    def __init__(self, model_class, machine_types, device=None, save_directory="saved_models", **overrides):
+        self.model_class = model_class
+        self.machine_types = list(machine_types)
+        super(MultiModelTrainer, self).__init__(GroupedAutoencoder(model_class, len(self.machine_types)), device=device, save_directory=save_directory, **overrides)
+
+
+    #> clip_machine_types holds the machine type of every clip, as returned by DataBundler.load_dataset_by_machine_type
+    def train(self, training_data, clip_machine_types, clip_lengths, model_name=None):
+        type_indices = {machine_type: i for i, machine_type in enumerate(self.machine_types)}
+        self.frame_groups = np.repeat([type_indices[machine_type] for machine_type in clip_machine_types], clip_lengths)
+
+        return super(MultiModelTrainer, self).train(training_data, model_name=model_name or self.model_class.__name__)
+
+
+    def make_batches(self, training_data):
+        return GroupedBatches(training_data, self.frame_groups, len(self.machine_types), self.batch_size, self.shuffle, self.pin_memory)
+
+
+    #> Writes one plain model_class checkpoint per machine type
+    def save_checkpoint(self, name, epoch):
+        checkpoint_paths = []
+
+        for i, machine_type in enumerate(self.machine_types):
+            model = self.model.export(i)
+            checkpoint_path = os.path.join(self.save_directory, f"{name}_{machine_type}.pth")
+            torch.save({
+                'model_class': self.model_class.__name__,
+                'machine_type': machine_type,
+                'model_state_dict': model.state_dict(),
+                'epoch': epoch,
+                'training_losses': self.training_losses,
+                'history': self.history,
+                'hyper_parameters': self.hyper_parameters,
+            }, checkpoint_path)
+            checkpoint_paths.append(checkpoint_path)
+
+        return checkpoint_paths
+
+
+
+#> Yields (models, batch, features) batches with batch_size frames of every machine type.
+#> An epoch is one pass over the largest machine type, smaller ones are reshuffled and revisited.
+class GroupedBatches:
+    def __init__(self, data, frame_groups, number_of_groups, batch_size, shuffle=True, pin_memory=False):
+        self.data = data if isinstance(data, torch.Tensor) else torch.from_numpy(np.asarray(data, dtype=np.float32))
+        self.group_indices = [torch.from_numpy(np.flatnonzero(frame_groups == group)) for group in range(number_of_groups)]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory
+
+        for group, indices in enumerate(self.group_indices):
+            if len(indices) == 0:
+                raise ValueError(f"Machine type {group} has no frames")
+
+
+    def __len__(self):
+        return (max(len(indices) for indices in self.group_indices) + self.batch_size - 1) // self.batch_size
+
+
+    def order(self, indices):
+        return indices[torch.randperm(len(indices))] if self.shuffle else indices
+
+
+    def __iter__(self):
+        orders = [self.order(indices) for indices in self.group_indices]
+        positions = [0] * len(orders)
+
+        for _ in range(len(self)):
+            batch_indices = []
+
+            for group, indices in enumerate(self.group_indices):
+                while len(orders[group]) - positions[group] < self.batch_size: #wrap around with a fresh order
+                    orders[group] = torch.cat((orders[group][positions[group]:], self.order(indices)))
+                    positions[group] = 0
+
+                batch_indices.append(orders[group][positions[group]:positions[group] + self.batch_size])
+                positions[group] += self.batch_size
+
+            batch = self.data[torch.stack(batch_indices)] #one gather for all models
+            yield batch.pin_memory() if self.pin_memory else batch
@@ -0,0 +1,91 @@
+import io
+import os
+import posixpath
+from tqdm import tqdm
+from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor
+
+import data_bundler
+from feature_store import FeatureStoreWriter
+from manifest import parse_filename, parse_directory
+
+#> every worker keeps the archives it reads from open
+worker_zip_files = {}
+
+
+def extract_member_features(task):
+    zip_path, member_name, extract_to = task
+
+    if zip_path not in worker_zip_files:
+        worker_zip_files[zip_path] = ZipFile(zip_path, 'r')
+
+    if data_bundler.worker_audio_converter is None:
+        data_bundler.initialise_worker()
+
+    member_bytes = worker_zip_files[zip_path].read(member_name) #decompressed once, for the features and the optional raw copy
+    if extract_to is not None:
+        write_member(member_bytes, member_name, extract_to)
+
+    return data_bundler.worker_audio_converter.wav_to_input(io.BytesIO(member_bytes)) #decoded from memory
+
+
+#> Writes a member's bytes below extract_to, refusing names that would end up outside it (like ZipFile.extract does)
+def write_member(member_bytes, member_name, extract_to):
+    root_path = os.path.abspath(extract_to)
+    file_path = os.path.abspath(os.path.join(root_path, *[part for part in member_name.split('/') if part not in ('', '.', '..')]))
+    if os.path.commonpath((root_path, file_path)) != root_path:
+        raise ValueError(f"Refusing to extract '{member_name}' outside of {extract_to}")
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as file:
+        file.write(member_bytes)
+
+
+#> Reads the WAV members of a dataset zip and writes their features straight into a feature store
+class ZipIngester:
+    def __init__(self, number_of_workers=None, chunk_size=None):
+        bundler = data_bundler.DataBundler(number_of_workers=number_of_workers, chunk_size=chunk_size, use_cache=False)
+        self.number_of_workers = bundler.number_of_workers
+        self.chunk_size = bundler.chunk_size
+
+
+    def wav_members(self, zip_path):
+        with ZipFile(zip_path, 'r') as zip_file:
+            return sorted(name for name in zip_file.namelist() if name.lower().endswith('.wav'))
+
+
+    #> e.g. dev_bearing/bearing/train/section_00_...wav -> machine type 'bearing'
+    def member_metadata(self, member_name):
+        metadata = parse_filename(member_name)
+        metadata['machine_type'] = parse_directory(posixpath.dirname(member_name))['machine_type'] #e.g. bearing/train/section_00_...wav
+        metadata['member'] = member_name
+        return metadata
+
+
+    def ingest(self, zip_path, store_directory, extract_to=None):
+        members = self.wav_members(zip_path)
+        tasks = [(zip_path, member_name, extract_to) for member_name in members]
+
+        with FeatureStoreWriter(store_directory) as writer, tqdm(total=len(tasks), desc=f"Ingesting {os.path.basename(zip_path)}", unit="file") as progress_bar:
+            if self.number_of_workers > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=data_bundler.initialise_worker) as executor:
+                    results = executor.map(extract_member_features, tasks, chunksize=self.chunk_size)
+                    for member_name, (clip_length, input_features) in zip(members, results):
+                        writer.append(posixpath.basename(member_name), clip_length, input_features, self.member_metadata(member_name))
+                        progress_bar.update(1)
+            else:
+                for member_name, task in zip(members, tasks):
+                    clip_length, input_features = extract_member_features(task)
+                    writer.append(posixpath.basename(member_name), clip_length, input_features, self.member_metadata(member_name))
+                    progress_bar.update(1)
+
+                if zip_path in worker_zip_files:
+                    worker_zip_files.pop(zip_path).close()
+
+        #> the raw WAV tree is optional (listening / visualisation), the WAVs were already written while ingesting, only the rest is left
+        if extract_to is not None:
+            with ZipFile(zip_path, 'r') as zip_file:
+                wav_members = set(members)
+                zip_file.extractall(extract_to, members=[name for name in zip_file.namelist() if name not in wav_members])
+
+        return store_directory
\ No newline at end of file